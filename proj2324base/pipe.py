@@ -7,7 +7,13 @@
 # 107028 Inês Paredes
 
 import sys
+import time
+import queue
+import random
+import itertools
+import multiprocessing
 import numpy as np
+from collections import deque
 
 from search import (
     Problem,
@@ -18,19 +24,146 @@ from search import (
     greedy_search,
     recursive_best_first_search,
 )
+from utils import luby
+from sat import CDCLSolver, write_dimacs
 
-# Dicionário com as conexões de cada peça (Esquerda, Cima, Direita, Baixo)
-pecasT = {'FC': (0, 1, 0, 0), 'FB': (0, 0, 0, 1), 'FD': (0, 0, 1, 0), 'FE': (1, 0, 0, 0),
-            'BC': (1, 1, 1, 0), 'BB': (1, 0, 1, 1), 'BD': (0, 1, 1, 1), 'BE': (1, 1, 0, 1),
-            'VC': (1, 1, 0, 0), 'VB': (0, 0, 1, 1), 'VD': (0, 1, 1, 0), 'VE': (1, 0, 0, 1),
-            'LH': (1, 0, 1, 0), 'LV': (0, 1, 0, 1)}
+# Bits de conexão de cada lado de uma peça (Esquerda, Cima, Direita, Baixo)
+ESQUERDA, CIMA, DIREITA, BAIXO = 1, 2, 4, 8
+LADOS = (ESQUERDA, CIMA, DIREITA, BAIXO)
+OPOSTOS = (DIREITA, BAIXO, ESQUERDA, CIMA) # Lado do vizinho que fica de frente para cada lado
+OPOSTO = (2, 3, 0, 1) # Índice do lado do vizinho que fica de frente para cada lado
 
-pecasF = {'FE', 'FC', 'FD', 'FB'}
-pecasB = {'BE', 'BC', 'BD', 'BB'}
-pecasV = {'VE', 'VC', 'VD', 'VB'}
-pecasL = {'LH', 'LV'}
+# Família de cada peça, guardada nos bits 4-5 do código da peça
+FECHO, BIFURCACAO, VOLTA, LIGACAO = 0, 1, 2, 3
+CONEXOES = 0xF # Máscara dos bits de conexão de um código
+
+def rodar(codigo, vezes=1):
+    """Roda uma peça 90º no sentido horário 'vezes' vezes, por rotação dos bits de conexão."""
+    mascara = codigo & CONEXOES
+    for _ in range(vezes % 4):
+        mascara = ((mascara << 1) | (mascara >> 3)) & CONEXOES
+    return (codigo & ~CONEXOES) | mascara
+
+# Código (família << 4 | conexões) de cada peça
+pecasT = {'FC': FECHO << 4 | CIMA, 'FB': FECHO << 4 | BAIXO,
+            'FD': FECHO << 4 | DIREITA, 'FE': FECHO << 4 | ESQUERDA,
+            'BC': BIFURCACAO << 4 | ESQUERDA | CIMA | DIREITA, 'BB': BIFURCACAO << 4 | ESQUERDA | DIREITA | BAIXO,
+            'BD': BIFURCACAO << 4 | CIMA | DIREITA | BAIXO, 'BE': BIFURCACAO << 4 | ESQUERDA | CIMA | BAIXO,
+            'VC': VOLTA << 4 | ESQUERDA | CIMA, 'VB': VOLTA << 4 | DIREITA | BAIXO,
+            'VD': VOLTA << 4 | CIMA | DIREITA, 'VE': VOLTA << 4 | ESQUERDA | BAIXO,
+            'LH': LIGACAO << 4 | ESQUERDA | DIREITA, 'LV': LIGACAO << 4 | CIMA | BAIXO}
+
+# Nome de cada código de peça, para imprimir o tabuleiro
+nomesT = [None] * 64
+for nome, codigo in pecasT.items():
+    nomesT[codigo] = nome
+
+# Orientações (códigos) possíveis de cada família, obtidas por rotação
+pecasF = tuple(sorted({rodar(pecasT['FC'], k) for k in range(4)}))
+pecasB = tuple(sorted({rodar(pecasT['BC'], k) for k in range(4)}))
+pecasV = tuple(sorted({rodar(pecasT['VC'], k) for k in range(4)}))
+pecasL = tuple(sorted({rodar(pecasT['LH'], k) for k in range(4)}))
+familias = (pecasF, pecasB, pecasV, pecasL) # Indexado pela família do código
+
+# Domínio de uma posição: conjunto de 16 bits em que o bit m indica que a máscara
+# de conexões m ainda é possível para a peça dessa posição
+dominiosT = tuple(sum(1 << (code & CONEXOES) for code in pecas) for pecas in familias)
+TODAS = 0xFFFF
+# Máscaras que têm conexão em cada lado (Esquerda, Cima, Direita, Baixo)
+comLado = tuple(sum(1 << m for m in range(16) if m & lado) for lado in LADOS)
+# Número de conexões de cada máscara
+ligacoesT = tuple(bin(m).count("1") for m in range(16))
+# Número de bits de cada byte, para contar as máscaras de um domínio
+bitsT = bytes(bin(b).count("1") for b in range(256))
+
+# Tabelas NumPy para a avaliação vetorizada de todo o tabuleiro
+dominiosA = np.array(dominiosT, dtype=np.uint16)
+bitsA = np.frombuffer(bitsT, dtype=np.uint8)
+# Máscara de conexões da orientação k (rotação de k * 90º de FC, BC, VC ou LH) de cada família
+orientacoesT = np.array([[rodar(pecasT[nome], k) & CONEXOES for k in range(4)]
+                         for nome in ('FC', 'BC', 'VC', 'LH')], dtype=np.uint16)
+
+# Número de baldes de posições por resolver: chave (tamanho do domínio - 2) * 5 +
+# (4 - vizinhos fixos), pelo que o balde 0 tem as posições mais restringidas
+BALDES = 15
+
+# Estado de uma ligação entre duas posições: conjunto dos valores ainda possíveis
+DESLIGADA, LIGADA = 1, 2
+# Valores possíveis da ligação de cada lado (Esquerda, Cima, Direita, Baixo) de
+# uma posição, dois bits por lado, para cada domínio de 16 bits
+_dominios = np.arange(1 << 16, dtype=np.uint32)
+suporteT = sum(((np.where(_dominios & (~comLado[i] & TODAS), DESLIGADA, 0)
+                 | np.where(_dominios & comLado[i], LIGADA, 0)) << 2 * i) for i in range(4)).astype(np.uint8).tobytes()
+del _dominios
+# Máscaras compatíveis com cada conjunto de valores da ligação de cada lado
+filtroT = tuple((0, ~comLado[i] & TODAS, comLado[i], TODAS) for i in range(4))
+
+# Tabelas planas de vizinhos, partilhadas pelos tabuleiros com as mesmas dimensões
+_vizinhosT = {}
+
+def tabela_vizinhos(rows, cols):
+    """Retorna a tabela de vizinhos de um tabuleiro rows x cols: a entrada
+    4 * index + i tem o índice do vizinho da posição 'index' no lado i
+    (Esquerda, Cima, Direita, Baixo), ou a sentinela rows * cols se esse
+    lado der para fora do tabuleiro."""
+    table = _vizinhosT.get((rows, cols))
+    if table is None:
+        n = rows * cols
+        table = []
+        for r in range(rows):
+            for c in range(cols):
+                index = r * cols + c
+                table += [index - 1 if c > 0 else n, index - cols if r > 0 else n,
+                          index + 1 if c < cols - 1 else n, index + cols if r < rows - 1 else n]
+        table = _vizinhosT[(rows, cols)] = tuple(table)
+    return table
+
+# Tabelas planas de ligações, partilhadas pelos tabuleiros com as mesmas dimensões
+_arestasT = {}
+
+def tabela_arestas(rows, cols):
+    """Retorna a tabela de ligações de um tabuleiro rows x cols: a entrada
+    4 * index + i tem o número da ligação do lado i da posição 'index', partilhada
+    com o vizinho desse lado. A ligação à direita de 'index' é 2 * index e a de
+    baixo é 2 * index + 1; os lados para fora do tabuleiro dão todos a ligação
+    2 * rows * cols, sempre desligada."""
+    table = _arestasT.get((rows, cols))
+    if table is None:
+        n = rows * cols
+        table = []
+        for r in range(rows):
+            for c in range(cols):
+                index = r * cols + c
+                table += [2 * (index - 1) if c > 0 else 2 * n, 2 * (index - cols) + 1 if r > 0 else 2 * n,
+                          2 * index if c < cols - 1 else 2 * n, 2 * index + 1 if r < rows - 1 else 2 * n]
+        table = _arestasT[(rows, cols)] = tuple(table)
+    return table
+
+# Chaves de Zobrist (64 bits), uma por par (posição, máscara), partilhadas pelos
+# tabuleiros com o mesmo número de posições
+_zobristT = {}
+
+def tabela_zobrist(n):
+    """Retorna as chaves de Zobrist de um tabuleiro com n posições: a entrada
+    16 * index + m é a chave da posição 'index' fixa com a máscara m."""
+    table = _zobristT.get(n)
+    if table is None:
+        rng = np.random.default_rng(n)
+        table = _zobristT[n] = tuple(rng.integers(0, 1 << 63, size=16 * n, dtype=np.int64).tolist())
+    return table
+
+# Tipos de entradas do trilho de alterações usado pela procura no lugar
+TRILHO_DOMINIO, TRILHO_UNIAO, TRILHO_CULPA, TRILHO_CULPA_COMPONENTE, TRILHO_LIGACAO = 0, 1, 2, 3, 4
+
+# Capacidade do conjunto de nogoods aprendidos e tamanho máximo de um nogood guardado
+NOGOODS = 4096
+NOGOOD_MAXIMO = 12
+
+# Número máximo de posições sondadas de cada vez (ver Board.probe)
+SONDAGENS = 16
 
 class PipeManiaState:
+    __slots__ = ('board', 'id') # Estados compactos, sem __dict__
     state_id = 0
 
     def __init__(self, board):
@@ -41,136 +174,845 @@ class PipeManiaState:
     def __lt__(self, other):
         return self.id < other.id
 
+    def __eq__(self, other):
+        """Dois estados são iguais se tiverem os mesmos domínios. O hash de Zobrist
+        é comparado primeiro, para só comparar os tabuleiros quando coincide."""
+        return isinstance(other, PipeManiaState) and self.board.hash == other.board.hash \
+            and np.array_equal(self.board.domains, other.board.domains)
+
+    def __hash__(self):
+        return self.board.hash
+
 class Board:
     """Representação interna de um tabuleiro de PipeMania."""
     
     def __init__(self, matrix):
-        self.matrix = np.array(matrix)
+        self.matrix = np.array(matrix, dtype=np.uint8) # Código de cada peça
         self.rows, self.cols = self.matrix.shape
+        self.cells = self.matrix.reshape(-1) # Vista plana da matriz, indexada por linha * cols + coluna
+        self.neighbors = tabela_vizinhos(self.rows, self.cols)
+        self.edge_ids = tabela_arestas(self.rows, self.cols)
+        self.zobrist = tabela_zobrist(self.rows * self.cols)
+        self.trail = None # Trilho de alterações, só usado na procura no lugar
+        # Níveis de decisão (conjunto de bits) responsáveis pelas reduções do domínio de
+        # cada posição e pelas peças de cada componente (indexada pela raiz), e níveis
+        # responsáveis pela última falha (None se desconhecidos); só usados na procura
+        # com retrocesso dirigido por conflitos
+        self.culprits = None
+        self.component_culprits = None
+        self.conflict = None
 
-    def print_matrix(self):
-        for row in self.matrix:
-            print("\t".join(str(item) for item in row))
+    def print_matrix(self, file=None):
+        """Escreve o tabuleiro em 'file' (por omissão o standard output)."""
+        print("\n".join("\t".join(nomesT[item] for item in row) for row in self.matrix.tolist()), file=file)
 
-    def get_value(self, row: int, col: int) -> tuple:
+    def get_value(self, row: int, col: int) -> str:
         """Devolve a peça na respetiva posição do tabuleiro."""
         if 0 <= row < self.rows and 0 <= col < self.cols:
-            return self.matrix[row][col]
+            return nomesT[self.matrix[row, col]]
+        return None
+
+    def get_code(self, row: int, col: int) -> int:
+        """Devolve o código da peça na respetiva posição do tabuleiro."""
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return self.matrix.item(row, col)
         return None
 
     def get_neighbors(self, row, col):
-        """Retorna uma lista de tuplas contendo os valores dos vizinhos e seus índices de direção."""
-        neighbors = [
-            (self.get_value(row, col-1), 0),  # Esquerda
-            (self.get_value(row-1, col), 1),  # Cima
-            (self.get_value(row, col+1), 2),  # Direita
-            (self.get_value(row+1, col), 3)   # Baixo
-        ]
-        return neighbors
+        """Retorna uma lista de tuplas contendo os códigos dos vizinhos e seus índices de direção."""
+        index = row * self.cols + col
+        n = self.rows * self.cols
+        return [(self.cells.item(neighbor) if neighbor < n else None, i)
+                for i, neighbor in enumerate(self.neighbors[4 * index:4 * index + 4])]
     
     def determine_neighbor_position(self, row, col, index):
         """Determina a posição do vizinho com base no índice."""
-        if index == 0:  # Esquerda
-            return row, col-1 if col-1 >= 0 else None
-        elif index == 1:  # Cima
-            return row-1, col if row-1 >= 0 else None
-        elif index == 2:  # Direita
-            return row, col+1 if col+1 < self.cols else None
-        elif index == 3:  # Baixo
-            return row+1, col if row+1 < self.rows else None
+        neighbor = self.neighbors[4 * (row * self.cols + col) + index]
+        if neighbor == self.rows * self.cols:
+            return None, None
+        return divmod(neighbor, self.cols)
 
     @staticmethod
     def parse_instance():
         """Lê o texto do standard input (stdin) e retorna uma instância da classe Board."""
         input_lines = sys.stdin.read().splitlines()
-        matrix = [line.split() for line in input_lines if line.strip()]
+        matrix = [Board.parse_row(line, number) for number, line in enumerate(input_lines, 1) if line.strip()]
         return Board(matrix).calculate_state()
 
-    def calculate_state(self):
-        """Calcula os valores do estado interno, para ser usado no tabuleiro inicial."""
-        self.incompatible_pieces = [] # Lista de peças que não estão na sua posição correta
-        possible_pieces = np.empty((self.rows, self.cols), dtype=object) # Possíveis peças para cada posição
-
-        for r in range(self.rows):
-            for c in range(self.cols):
-                possible_pieces[r, c] = []
-
-        for r in range(self.rows):
-            for c in range(self.cols):
-                none_neighbors = [] # Lista de vizinhos None
-                filtered_neighbors = [] # Lista de vizinhos que já têm peça na posição correta
-                piece = self.get_value(r, c)
-                pecas = pecasL if piece in pecasL else pecasB if piece in pecasB else pecasV \
-                    if piece in pecasV else pecasF if piece in pecasF else None
-
-                for i in range(4):
-                    row, col = self.determine_neighbor_position(r, c, i)
-                    if row is not None and col is not None:
-                        if len(possible_pieces[row, col]) == 1:
-                            filtered_neighbors.append((possible_pieces[row, col][0], i))
-                    else:
-                        none_neighbors.append((row, i))
-
-                # Calcula as possíveis peças para a posição (r, c)
-                for piece_name in pecas:
-                    orientation = pecasT[piece_name]
-                    is_compatible = True
-                    is_compatible = all(orientation[index] != 1 for _, index in none_neighbors)
-                    for neighbor_piece, index in filtered_neighbors:
-                        neighbor_connections = pecasT[neighbor_piece]
-                        if piece_name in pecasF and neighbor_piece in pecasF and orientation[index] == 1:
-                            is_compatible = False
-                            break
-
-                        elif orientation[index] != neighbor_connections[(index + 2) % 4]:
-                            is_compatible = False
-                            break
-                    if is_compatible:
-                        possible_pieces[r, c].append(piece_name)
-
-                if len(possible_pieces[r, c]) > 1:
-                    self.incompatible_pieces.insert(0, (r, c))
-                else:
-                    self.matrix[r][c] = possible_pieces[r, c][0] # Atualiza a peça na posição (r, c)
+    @staticmethod
+    def parse_row(line, number):
+        """Retorna os códigos das peças da linha de texto 'line', a linha 'number'
+        da entrada; uma peça desconhecida dá um ValueError que indica a linha."""
+        try:
+            return [pecasT[piece] for piece in line.split()]
+        except KeyError as error:
+            raise ValueError("Peça desconhecida {} na linha {}".format(error, number)) from None
+
+    @staticmethod
+    def parse_instances(stream=None):
+        """Lê vários tabuleiros de 'stream' (por omissão o standard input), separados
+        por linhas em branco, e retorna-os um a um à medida que são lidos. Se a
+        primeira linha não vazia tiver só um número, este indica quantos tabuleiros
+        ler."""
+        for matrix in Board.read_matrices(stream):
+            yield Board(matrix).calculate_state()
+
+    @staticmethod
+    def read_matrices(stream=None):
+        """Como parse_instances, mas retorna só a matriz de códigos de cada tabuleiro."""
+        stream = sys.stdin if stream is None else stream
+        count = None
+        matrix = []
+        for number, line in enumerate(stream, 1):
+            pieces = line.split()
+            if count is None:
+                if not pieces:
+                    continue # Linhas em branco antes do cabeçalho
+                count = -1 # Sem cabeçalho, lê até ao fim
+                if len(pieces) == 1 and pieces[0].isdigit():
+                    count = int(pieces[0])
+                    continue
+            if pieces:
+                matrix.append(Board.parse_row(line, number))
+            elif matrix:
+                yield matrix
+                matrix = []
+                count -= 1
+            if count == 0:
+                return
+        if matrix and count != 0:
+            yield matrix
+
+    def calculate_state(self, deduce=False):
+        """Calcula os valores do estado interno, para ser usado no tabuleiro inicial.
+        Com 'deduce', aplica no fim as regras de dedução (ver Board.deduce)."""
+        n = self.rows * self.cols
+        # Máscaras possíveis de cada posição; a sentinela n (fora do tabuleiro) só
+        # admite a máscara sem conexões
+        self.domains = np.empty(n + 1, dtype=np.uint16)
+        self.domains[:n] = dominiosA[self.cells >> 4]
+        self.domains[n] = 1
+        self.pending = bytearray(b'\x01') * n # 1 nas posições por resolver
+        # Vizinhos fixos ou fora do tabuleiro de cada posição
+        fixed = np.zeros((self.rows, self.cols), dtype=np.uint8)
+        fixed[:, 0] += 1
+        fixed[0, :] += 1
+        fixed[:, -1] += 1
+        fixed[-1, :] += 1
+        self.fixed_neighbors = bytearray(fixed.tobytes())
+        # Balde de cada posição por resolver e posições por resolver, por balde (ver bucket_key)
+        domains = self.domains[:n]
+        keys = ((bitsA[domains & 0xFF] + bitsA[domains >> 8] - 2) * 5 + 4 - fixed.reshape(-1)).astype(np.uint8)
+        self.bucket_of = bytearray(keys.tobytes())
+        self.buckets = [set(np.flatnonzero(keys == key).tolist()) for key in range(BALDES)]
+        self.queued = bytearray(n) # Posições na fila de propagação (sempre a zeros fora de propagate)
+        # Valores possíveis de cada ligação (ver tabela_arestas); a última é a de fora do tabuleiro
+        self.edges = bytearray([DESLIGADA | LIGADA]) * (2 * n) + bytearray([DESLIGADA])
+        self.unresolved = n # Número de posições por resolver
+        self.components = 0 # Número de componentes formadas pelas posições fixas
+        self.free = 0 # Conexões das posições fixas ainda sem par (soma de open das componentes)
+        self.mismatches = 0 # Conexões de posições fixas viradas para um vizinho fixo sem conexão
+        self.hash = 0 # Hash de Zobrist das peças fixas
+
+        # Componentes das posições fixas (union-find sem compressão, para poder desfazer)
+        self.parent = np.arange(n, dtype=np.int32)
+        self.size = np.ones(n, dtype=np.int32)
+        self.open = np.zeros(n, dtype=np.int32) # Conexões da componente ainda sem par
+        # Se o número de ligações da solução (metade das conexões) for n - 1, a solução
+        # é uma árvore e qualquer ciclo pode ser rejeitado
+        connections = sum(ligacoesT[code & CONEXOES] for code in self.cells.tolist())
+        self.tree = connections == 2 * (n - 1)
 
+        # Redução inicial: passagens vetorizadas por todo o tabuleiro enquanto mudam
+        # muitas posições; o resto da propagação, já localizada, fica para o AC-3.
+        # Os domínios iniciais não restringem os vizinhos, pelo que basta propagar
+        # a partir das posições alteradas
+        initial = self.domains
+        domains = self.reduce_domains(initial)
+        while True:
+            reduced = self.reduce_domains(domains)
+            changes = np.count_nonzero(reduced != domains)
+            domains = reduced
+            if changes * 32 < n:
+                break
+        changed = np.flatnonzero(domains != initial).tolist()
+        self.valid = self.apply_domains(domains) and self.propagate(changed)
+        if deduce:
+            self.valid = self.valid and self.deduce()
         return self
 
+    def copy(self):
+        """Retorna uma cópia independente do tabuleiro e do seu estado interno."""
+        board = Board(np.copy(self.matrix))
+        board.domains = np.copy(self.domains)
+        board.pending = bytearray(self.pending)
+        board.fixed_neighbors = bytearray(self.fixed_neighbors)
+        board.bucket_of = bytearray(self.bucket_of)
+        board.buckets = [set(bucket) for bucket in self.buckets]
+        board.queued = bytearray(self.queued)
+        board.edges = bytearray(self.edges)
+        board.unresolved = self.unresolved
+        board.components = self.components
+        board.free = self.free
+        board.mismatches = self.mismatches
+        board.hash = self.hash
+        board.parent = np.copy(self.parent)
+        board.size = np.copy(self.size)
+        board.open = np.copy(self.open)
+        board.tree = self.tree
+        board.valid = self.valid
+        return board
+
+    def candidates(self, domains=None):
+        """Avalia todas as posições de uma vez: retorna um tensor booleano
+        (rows, cols, 4) em que a entrada [row, col, k] indica se a peça dessa
+        posição, na orientação k (ver orientacoesT), ainda está no domínio e é
+        compatível com os limites do tabuleiro e com os domínios dos vizinhos.
+        Por omissão usa os domínios do tabuleiro."""
+        if domains is None:
+            domains = self.domains
+        rows, cols = self.rows, self.cols
+        families = self.matrix >> 4
+        masks = orientacoesT[families]
+        # Domínios e famílias dos vizinhos de cada lado, com a moldura fora do tabuleiro
+        padded = np.ones((rows + 2, cols + 2), dtype=np.uint16)
+        padded[1:-1, 1:-1] = domains[:rows * cols].reshape(rows, cols)
+        around = np.full((rows + 2, cols + 2), -1, dtype=np.int8)
+        around[1:-1, 1:-1] = families
+        sides = ((slice(1, -1), slice(None, -2)), (slice(None, -2), slice(1, -1)),
+                 (slice(1, -1), slice(2, None)), (slice(2, None), slice(1, -1)))
+
+        candidates = ((padded[1:-1, 1:-1, None] >> masks) & 1).astype(bool)
+        closing = families == FECHO if rows * cols > 2 else np.zeros_like(families, dtype=bool)
+        for i, side in enumerate(sides):
+            facing = comLado[OPOSTO[i]]
+            neighbor = padded[side]
+            can_connect = (neighbor & facing) != 0
+            can_connect &= ~(closing & (around[side] == FECHO)) # Dois fechos não se podem ligar
+            can_close = (neighbor & (~facing & TODAS)) != 0
+            candidates &= np.where((masks & LADOS[i]) != 0, can_connect[..., None], can_close[..., None])
+        return candidates
+
+    def reduce_domains(self, domains=None):
+        """Faz uma passagem vetorizada de propagação: retorna uma cópia dos
+        domínios (com a sentinela) restringida às orientações candidatas."""
+        candidates = self.candidates(domains)
+        masks = orientacoesT[self.matrix >> 4]
+        reduced = np.ones(self.rows * self.cols + 1, dtype=np.uint16)
+        reduced[:-1] = np.bitwise_or.reduce(candidates.astype(np.uint16) << masks, axis=2).reshape(-1)
+        return reduced
+
+    def apply_domains(self, domains):
+        """Restringe cada posição cujo domínio difere de 'domains'. Retorna False
+        se alguma ficar sem peças possíveis ou se uma peça fixada fechar um ciclo
+        ou uma componente isolada."""
+        for index in np.flatnonzero(domains != self.domains).tolist():
+            domain = domains.item(index)
+            if not domain or not self.restrict(index, domain):
+                return False
+        return True
+
+    def sweep(self):
+        """Propaga as restrições com uma única passagem vetorizada por todo o tabuleiro.
+        Retorna False se o tabuleiro deixar de ter solução."""
+        return self.apply_domains(self.reduce_domains())
+
+    def is_fixed(self, index):
+        """Verifica se a posição 'index' tem uma única peça possível."""
+        return not self.pending[index]
+
+    def bucket_key(self, index):
+        """Calcula o balde da posição por resolver 'index': menos peças possíveis e,
+        em caso de empate, mais vizinhos fixos (ou fora do tabuleiro) dão um
+        balde menor."""
+        domain = self.domains.item(index)
+        return (bitsT[domain & 0xFF] + bitsT[domain >> 8] - 2) * 5 + 4 - self.fixed_neighbors[index]
+
+    def update_bucket(self, index):
+        """Move a posição por resolver 'index' para o balde correspondente ao seu estado atual."""
+        key = self.bucket_key(index)
+        old = self.bucket_of[index]
+        if key != old:
+            self.buckets[old].discard(index)
+            self.buckets[key].add(index)
+            self.bucket_of[index] = key
+
+    def set_domain(self, index, domain, code):
+        """Altera o domínio e a peça da posição 'index', mantendo os baldes, as
+        posições por resolver e os contadores de componentes e de conexões sem par."""
+        fixed = domain & (domain - 1) == 0
+        fixed_code = code if fixed else self.cells.item(index) # Peça que fica (ou deixa de estar) fixa
+        self.domains[index] = domain
+        self.cells[index] = code
+        if fixed == (not self.pending[index]):
+            if not fixed:
+                self.update_bucket(index)
+            return
+
+        delta = 1 if fixed else -1
+        self.hash ^= self.zobrist[16 * index + (fixed_code & CONEXOES)]
+        self.unresolved -= delta
+        self.components += delta # Cada posição fixada começa numa componente própria
+        self.free += delta * ligacoesT[fixed_code & CONEXOES]
+        if fixed:
+            self.pending[index] = 0
+            self.buckets[self.bucket_of[index]].discard(index)
+        else:
+            self.pending[index] = 1
+            self.bucket_of[index] = key = self.bucket_key(index)
+            self.buckets[key].add(index)
+        n = self.rows * self.cols
+        for i, neighbor in enumerate(self.neighbors[4 * index:4 * index + 4]):
+            if neighbor == n:
+                continue
+            self.fixed_neighbors[neighbor] += delta
+            if self.pending[neighbor]:
+                self.update_bucket(neighbor)
+            elif bool(fixed_code & LADOS[i]) != bool(self.cells.item(neighbor) & OPOSTOS[i]):
+                self.mismatches += delta
+
+    def restrict(self, index, domain):
+        """Restringe o domínio da posição 'index', fixando a peça se só restar uma.
+        Retorna False se a peça fixada fechar um ciclo ou uma componente isolada."""
+        code = self.cells.item(index)
+        old = self.domains.item(index)
+        if self.trail is not None:
+            self.trail.append((TRILHO_DOMINIO, index, old, code))
+        if domain & (domain - 1) == 0:
+            code = (code & ~CONEXOES) | (domain.bit_length() - 1)
+            self.set_domain(index, domain, code)
+            if old & (old - 1):
+                return self.join(index)
+            return True
+        self.set_domain(index, domain, code)
+        return True
+
+    def find(self, index):
+        """Retorna a raiz da componente da posição com índice 'index'."""
+        parent = self.parent
+        while parent.item(index) != index:
+            index = parent.item(index)
+        return index
+
+    def union(self, a, b):
+        """Junta as componentes das posições 'a' e 'b', ligadas entre si. Retorna
+        False se a ligação fechar um ciclo numa solução que tem de ser uma árvore
+        ou se deixar uma componente sem conexões livres antes de cobrir o tabuleiro."""
+        ra, rb = self.find(a), self.find(b)
+        blamed = self.component_culprits
+        if ra == rb:
+            if blamed is not None:
+                self.conflict = blamed[ra]
+            if self.trail is not None:
+                self.trail.append((TRILHO_UNIAO, -1, ra, self.open.item(ra)))
+            self.open[ra] -= 2
+            self.free -= 2
+            if self.tree:
+                return False
+        else:
+            if self.size.item(ra) < self.size.item(rb):
+                ra, rb = rb, ra
+            if self.trail is not None:
+                self.trail.append((TRILHO_UNIAO, rb, ra, self.open.item(ra)))
+            self.parent[rb] = ra
+            self.size[ra] += self.size.item(rb)
+            self.components -= 1
+            self.open[ra] += self.open.item(rb) - 2
+            self.free -= 2
+            if blamed is not None:
+                if self.trail is not None:
+                    self.trail.append((TRILHO_CULPA_COMPONENTE, ra, blamed[ra]))
+                blamed[ra] |= blamed[rb]
+                self.conflict = blamed[ra]
+        return self.open.item(ra) > 0 or self.size.item(ra) == self.rows * self.cols
+
+    def join(self, index):
+        """Junta a posição 'index', acabada de fixar, às componentes dos vizinhos
+        fixos a que está ligada. Retorna False se isso fechar um ciclo ou uma
+        componente isolada."""
+        code = self.cells.item(index)
+        self.parent[index] = index
+        self.size[index] = 1
+        self.open[index] = ligacoesT[code & CONEXOES]
+        if self.component_culprits is not None:
+            self.component_culprits[index] = self.culprits[index]
+        n = self.rows * self.cols
+        for i, neighbor in enumerate(self.neighbors[4 * index:4 * index + 4]):
+            if code & LADOS[i] and neighbor < n and self.is_fixed(neighbor) \
+                    and self.cells.item(neighbor) & OPOSTOS[i]:
+                if not self.union(index, neighbor):
+                    return False
+        return True
+
+    def assign(self, row, col, piece):
+        """Fixa a peça 'piece' na posição (row, col) e propaga as restrições.
+        Retorna False se o tabuleiro ficar inconsistente."""
+        index = row * self.cols + col
+        self.conflict = None
+        return self.restrict(index, 1 << (piece & CONEXOES)) and self.propagate([index])
+
+    def blame(self, index, levels):
+        """Junta os níveis de decisão 'levels' aos responsáveis pelo domínio da posição 'index'."""
+        if self.trail is not None:
+            self.trail.append((TRILHO_CULPA, index, self.culprits[index]))
+        self.culprits[index] |= levels
+
+    def is_solved(self):
+        """Verifica, em tempo constante, se todas as peças estão fixas, sem conexões
+        sem par, e formam uma única componente."""
+        return self.valid and self.unresolved == 0 and self.components == 1 and self.mismatches == 0
+
+    def min_domain(self):
+        """Retorna o menor número de peças possíveis de uma posição por resolver
+        (1 se estiverem todas fixas)."""
+        for key, bucket in enumerate(self.buckets):
+            if bucket:
+                return key // 5 + 2
+        return 1
+
+    def most_constrained(self):
+        """Retorna a posição por resolver com menos peças possíveis (e mais vizinhos
+        fixos em caso de empate), ou None se todas estiverem fixas."""
+        for bucket in self.buckets:
+            if bucket:
+                return divmod(next(iter(bucket)), self.cols)
+        return None
+
+    def propagate(self, changed):
+        """Propaga as restrições até não haver mais alterações (AC-3 sobre as
+        ligações). 'changed' contém os índices das posições cujo domínio mudou: cada
+        uma restringe os valores possíveis das suas ligações, e só as ligações que
+        mudam restringem o vizinho do outro lado. Retorna False se alguma posição
+        ficar sem peças possíveis."""
+        n = self.rows * self.cols
+        neighbors = self.neighbors
+        edge_ids = self.edge_ids
+        edges = self.edges
+        trail = self.trail
+        domains = self.domains
+        changed = deque(changed)
+        queued = self.queued
+        for index in changed:
+            queued[index] = 1
+
+        while changed:
+            index = changed.popleft()
+            queued[index] = 0
+            support = suporteT[domains.item(index)]
+            for i, neighbor in enumerate(neighbors[4 * index:4 * index + 4]):
+                if neighbor == n:
+                    continue # A ligação para fora do tabuleiro é constante
+                edge = edge_ids[4 * index + i]
+                state = edges[edge]
+                allowed = state & (support >> 2 * i)
+                if allowed == state:
+                    continue
+                # A ligação perdeu valores: o vizinho do outro lado só fica com as
+                # peças compatíveis com os que restam
+                if trail is not None:
+                    trail.append((TRILHO_LIGACAO, edge, state))
+                edges[edge] = allowed
+                old = domains.item(neighbor)
+                new = old & filtroT[OPOSTO[i]][allowed]
+                if new != old:
+                    culprits = self.culprits
+                    if culprits is not None:
+                        if culprits[index] & ~culprits[neighbor]:
+                            self.blame(neighbor, culprits[index])
+                        self.conflict = culprits[neighbor] if not new else None
+                    if not new or not self.restrict(neighbor, new):
+                        for index in changed:
+                            queued[index] = 0
+                        return False
+                    if not queued[neighbor]:
+                        queued[neighbor] = 1
+                        changed.append(neighbor)
+        return True
+
+    def undo(self, mark):
+        """Desfaz as alterações registadas no trilho até este ter 'mark' entradas."""
+        trail = self.trail
+        while len(trail) > mark:
+            entry = trail.pop()
+            if entry[0] == TRILHO_DOMINIO:
+                _, index, domain, code = entry
+                self.set_domain(index, domain, code)
+            elif entry[0] == TRILHO_LIGACAO:
+                self.edges[entry[1]] = entry[2]
+            elif entry[0] == TRILHO_CULPA:
+                self.culprits[entry[1]] = entry[2]
+            elif entry[0] == TRILHO_CULPA_COMPONENTE:
+                self.component_culprits[entry[1]] = entry[2]
+            else:
+                _, child, root, open_ends = entry
+                if child >= 0:
+                    self.parent[child] = child
+                    self.size[root] -= self.size.item(child)
+                    self.components += 1
+                self.open[root] = open_ends
+                self.free += 2
+
+    def border_order(self):
+        """Retorna os índices das posições da borda para dentro: primeiro os cantos,
+        depois o resto da borda e depois cada anel interior."""
+        rows, cols = self.rows, self.cols
+        r, c = np.divmod(np.arange(rows * cols), cols)
+        ring = np.minimum(np.minimum(r, c), np.minimum(rows - 1 - r, cols - 1 - c))
+        corner = ((r == 0) | (r == rows - 1)) & ((c == 0) | (c == cols - 1))
+        return np.lexsort((~corner, ring)).tolist()
+
+    def deduce(self, rules=None):
+        """Aplica as regras de dedução ('rules', por omissão REGRAS) às posições por
+        resolver, com uma lista de trabalho semeada dos cantos e da borda para
+        dentro. Cada redução é propagada e volta a pôr na lista os vizinhos das
+        posições alteradas. Retorna False se o tabuleiro deixar de ter solução."""
+        if rules is None:
+            rules = REGRAS
+        n = self.rows * self.cols
+        neighbors = self.neighbors
+        pending = self.pending
+        # O trilho indica que posições mudaram com cada propagação; se não houver
+        # procura em curso usa-se um temporário
+        saved = self.trail
+        trail = self.trail = [] if saved is None else saved
+        worklist = deque(self.border_order())
+        listed = bytearray(b'\x01') * n
+        valid = True
+        while worklist and valid:
+            index = worklist.popleft()
+            listed[index] = 0
+            if not pending[index]:
+                continue
+            old = self.domains.item(index)
+            domain = old
+            for rule in rules:
+                domain = rule(self, index, domain)
+            if domain == old:
+                continue
+            mark = len(trail)
+            valid = bool(domain) and self.restrict(index, domain) and self.propagate([index])
+            for entry in trail[mark:]:
+                if entry[0] != TRILHO_DOMINIO:
+                    continue
+                for neighbor in neighbors[4 * entry[1]:4 * entry[1] + 4]:
+                    if neighbor < n and pending[neighbor] and not listed[neighbor]:
+                        listed[neighbor] = 1
+                        worklist.append(neighbor)
+            if saved is None:
+                trail.clear()
+        self.trail = saved
+        return valid
+
+    def probe(self, budget=SONDAGENS, cache=None):
+        """Sondagem (consistência de arco singular) das posições a ramificar, pela
+        ordem dos baldes: cada peça possível é fixada à experiência e propagada, e
+        as que falham são retiradas; se só restar uma, a posição fica fixa sem
+        ramificar. Sonda no máximo 'budget' posições. Se 'cache' for um dicionário,
+        guarda as posições em que nenhuma peça falhou, com os domínios da
+        vizinhança, para não as voltar a sondar enquanto esta não mudar. Retorna
+        False se o tabuleiro deixar de ter solução."""
+        neighbors = self.neighbors
+        domains = self.domains
+        saved = self.trail
+        trail = self.trail = [] if saved is None else saved
+        valid = True
+        while budget > 0 and valid:
+            for index in list(itertools.islice(itertools.chain.from_iterable(self.buckets), budget)):
+                around = neighbors[4 * index:4 * index + 4]
+                neighborhood = (domains.item(index), domains.item(around[0]), domains.item(around[1]),
+                                domains.item(around[2]), domains.item(around[3]))
+                if cache is not None and cache.get(index) == neighborhood:
+                    continue
+                budget -= 1
+                domain = neighborhood[0]
+                survivors = 0
+                for m in range(16):
+                    if domain >> m & 1:
+                        mark = len(trail)
+                        if self.restrict(index, 1 << m) and self.propagate([index]):
+                            survivors |= 1 << m
+                        self.undo(mark)
+                if survivors != domain:
+                    valid = bool(survivors) and self.restrict(index, survivors) and self.propagate([index])
+                    break # Os baldes mudaram
+                if cache is not None:
+                    cache[index] = neighborhood
+            else:
+                break
+            if saved is None:
+                trail.clear()
+        self.trail = saved
+        return valid
+
     def action_piece(self, row, col):
         """Retorna uma lista de peças possíveis para a posição (row, col)."""
-        filtered_neighbors = [] # Lista de vizinhos que já têm peça
-        possible_pieces = []
-
-        for i in range(4):
-            r, c = self.determine_neighbor_position(row, col, i)
-            if r is not None and c is not None:
-                if (r, c) not in self.incompatible_pieces:
-                    filtered_neighbors.append((self.get_value(r, c), i))
-
-        piece = self.get_value(row, col)
-        pecas = pecasL if piece in pecasL else pecasB if piece in pecasB else pecasV \
-            if piece in pecasV else pecasF if piece in pecasF else None
-
-        for piece_name in pecas:
-            orientation = pecasT[piece_name]
-            is_compatible = True
-            for neighbor_piece, index in filtered_neighbors:
-                neighbor_connections = pecasT[neighbor_piece]
-                if piece_name in pecasF and neighbor_piece in pecasF and orientation[index] == 1:
-                    is_compatible = False
-                    break
+        index = row * self.cols + col
+        family = self.cells.item(index) & ~CONEXOES
+        domain = self.domains.item(index)
+        return [family | m for m in range(16) if domain >> m & 1]
+
+# Regras de dedução usadas por Board.deduce: cada uma recebe o tabuleiro, uma
+# posição por resolver e o seu domínio atual, e retorna o domínio restringido.
+# As restrições locais (limites do tabuleiro, compatibilidade com os vizinhos,
+# fechos vizinhos) já são garantidas por candidates() e pela propagação
 
-                elif orientation[index] != neighbor_connections[(index + 2) % 4]:
-                    is_compatible = False
+def regra_isolamento(board, index, domain):
+    """Retira as peças que, ligadas às componentes fixas dos vizinhos, fechariam
+    uma componente sem conexões livres antes de cobrir o tabuleiro ou um ciclo
+    numa solução que tem de ser uma árvore."""
+    n = board.rows * board.cols
+    sides = [] # (lado, raiz) dos vizinhos fixos com conexão virada para esta posição
+    for i, neighbor in enumerate(board.neighbors[4 * index:4 * index + 4]):
+        if neighbor < n and not board.pending[neighbor] and board.cells.item(neighbor) & OPOSTOS[i]:
+            sides.append((i, board.find(neighbor)))
+    if not sides:
+        return domain
+    for m in range(16):
+        if not domain >> m & 1:
+            continue
+        open_ends, size, roots = ligacoesT[m], 1, set()
+        for i, root in sides:
+            if not m & LADOS[i]:
+                continue
+            if root in roots:
+                if board.tree:
                     break
-                    
-            if is_compatible:
-                possible_pieces.append(piece_name)
-                
-        return possible_pieces
+                open_ends -= 2
+            else:
+                roots.add(root)
+                open_ends += board.open.item(root) - 2
+                size += board.size.item(root)
+        else:
+            if open_ends > 0 or size == n:
+                continue
+        domain &= ~(1 << m)
+    return domain
+
+REGRAS = (regra_isolamento,)
+
+class Nogoods:
+    """Nogoods aprendidos: conjuntos de pares (índice, máscara) que não podem estar
+    todos fixos numa solução. Quando o conjunto se enche, é esquecida a metade
+    menos ativa; a atividade de um nogood cresce sempre que poda uma atribuição,
+    com mais peso para as podas recentes."""
+
+    def __init__(self, capacity=NOGOODS):
+        self.capacity = capacity
+        self.activity = {} # Atividade de cada nogood
+        self.watches = {} # Nogoods que contêm cada par (índice, máscara)
+        self.bump = 1.0
+
+    def learn(self, nogood):
+        """Guarda o nogood 'nogood' (um tuplo de pares (índice, máscara))."""
+        if nogood in self.activity:
+            return
+        if len(self.activity) >= self.capacity:
+            self.evict()
+        self.activity[nogood] = self.bump
+        for literal in nogood:
+            self.watches.setdefault(literal, []).append(nogood)
+
+    def evict(self):
+        """Esquece a metade menos ativa dos nogoods."""
+        keep = sorted(self.activity, key=self.activity.get, reverse=True)[:self.capacity // 2]
+        self.activity = {nogood: self.activity[nogood] for nogood in keep}
+        self.watches = {}
+        for nogood in keep:
+            for literal in nogood:
+                self.watches.setdefault(literal, []).append(nogood)
+
+    def violated(self, board, index, mask):
+        """Retorna um nogood que fique todo fixo em 'board' se a posição 'index'
+        for fixada com a máscara 'mask', ou None se não houver."""
+        domains = board.domains
+        for nogood in self.watches.get((index, mask), ()):
+            if all(other == index or domains.item(other) == 1 << m for other, m in nogood):
+                self.activity[nogood] += self.bump
+                self.bump *= 1.05
+                if self.bump > 1e100:
+                    for key in self.activity:
+                        self.activity[key] /= 1e100
+                    self.bump /= 1e100
+                return nogood
+        return None
+
+class PipeManiaCNF:
+    """Codificação de um tabuleiro em CNF, no formato de sat.py. Há uma variável
+    por cada máscara ainda possível de cada posição por resolver e uma por cada
+    ligação entre duas posições por resolver; as posições fixas, e as ligações a
+    posições fixas ou para fora do tabuleiro, são constantes. Cada posição tem
+    exatamente uma máscara, e cada máscara determina as ligações dos seus lados.
+    A conectividade (e a ausência de ciclos, numa solução que tem de ser uma
+    árvore) não é codificada: é imposta com cortes acrescentados a cada modelo
+    rejeitado (ver cuts)."""
+
+    def __init__(self, board):
+        self.board = board
+        self.nvars = 0
+        self.pieces = {} # Variável de cada par (índice, máscara)
+        self.edges = {} # Variável da ligação à direita ou abaixo de cada posição, por (índice, lado)
+        self.clauses = []
+        n = board.rows * board.cols
+        for index in range(n):
+            if board.is_fixed(index):
+                continue
+            domain = board.domains.item(index)
+            masks = [m for m in range(16) if domain >> m & 1]
+            for m in masks:
+                self.nvars += 1
+                self.pieces[(index, m)] = self.nvars
+            variables = [self.pieces[(index, m)] for m in masks]
+            self.clauses.append(variables) # Pelo menos uma máscara...
+            self.clauses.extend([-a, -b] for a, b in itertools.combinations(variables, 2)) # ...e no máximo uma
+            for i in range(4):
+                edge = self.edge(index, i)
+                for m in masks:
+                    piece = self.pieces[(index, m)]
+                    if edge is True or edge is False:
+                        if bool(m & LADOS[i]) != edge:
+                            self.clauses.append([-piece])
+                    else:
+                        self.clauses.append([-piece, edge if m & LADOS[i] else -edge])
+
+    def edge(self, index, i):
+        """Retorna a variável da ligação do lado i da posição 'index', ou True ou
+        False se a ligação for constante."""
+        board = self.board
+        n = board.rows * board.cols
+        neighbor = board.neighbors[4 * index + i]
+        if neighbor == n:
+            return False
+        if board.is_fixed(index):
+            return bool(board.cells.item(index) & LADOS[i])
+        if board.is_fixed(neighbor):
+            return bool(board.cells.item(neighbor) & OPOSTOS[i])
+        key = (index, i) if i >= 2 else (neighbor, OPOSTO[i])
+        variable = self.edges.get(key)
+        if variable is None:
+            self.nvars += 1
+            variable = self.edges[key] = self.nvars
+        return variable
+
+    def decode(self, model):
+        """Retorna a máscara de cada posição no modelo 'model' (ver CDCLSolver.model)."""
+        board = self.board
+        masks = [board.cells.item(index) & CONEXOES for index in range(board.rows * board.cols)]
+        for (index, m), variable in self.pieces.items():
+            if model[variable]:
+                masks[index] = m
+        return masks
+
+    def cuts(self, masks):
+        """Retorna as cláusulas que excluem o modelo com as máscaras 'masks', ou uma
+        lista vazia se este for solução. Cada componente que não cobre o tabuleiro
+        tem de ter uma ligação para fora; numa solução que é uma árvore, um ciclo de
+        cada componente tem de perder uma das suas ligações."""
+        board = self.board
+        n = board.rows * board.cols
+        neighbors = board.neighbors
+        component = [-1] * n
+        found = [] # (posições, ligação que fecha um ciclo e árvore de pais, ou None)
+        for start in range(n):
+            if component[start] >= 0:
+                continue
+            label = len(found)
+            component[start] = label
+            parent = {start: -1}
+            cells, closing = [start], None
+            for index in cells:
+                for i, neighbor in enumerate(neighbors[4 * index:4 * index + 4]):
+                    if masks[index] & LADOS[i] and neighbor < n:
+                        if component[neighbor] < 0:
+                            component[neighbor] = label
+                            parent[neighbor] = index
+                            cells.append(neighbor)
+                        elif closing is None and parent[index] != neighbor and index < neighbor:
+                            closing = (index, i)
+            found.append((cells, closing, parent))
+        if len(found) == 1:
+            return []
+
+        clauses = []
+        for label, (cells, closing, parent) in enumerate(found):
+            clause = []
+            for index in cells:
+                for i, neighbor in enumerate(neighbors[4 * index:4 * index + 4]):
+                    if neighbor < n and component[neighbor] != label:
+                        edge = self.edge(index, i)
+                        if edge is not True and edge is not False:
+                            clause.append(edge)
+            clauses.append(clause)
+            if board.tree and closing is not None:
+                clauses.append([-edge for edge in self.cycle(closing, parent) if edge is not True])
+        return clauses
+
+    def cycle(self, closing, parent):
+        """Retorna as ligações do ciclo fechado pela ligação 'closing' (índice, lado)
+        na árvore de pais 'parent' de uma componente."""
+        index, i = closing
+        other = self.board.neighbors[4 * index + i]
+        ancestors = []
+        node = index
+        while node >= 0:
+            ancestors.append(node)
+            node = parent[node]
+        position = {node: k for k, node in enumerate(ancestors)}
+        path = []
+        node = other
+        while node not in position:
+            path.append(node)
+            node = parent[node]
+        path = ancestors[:position[node] + 1] + path[::-1] # Passando pelo antepassado comum
+        edges = [self.edge(index, i)]
+        for a, b in zip(path, path[1:]):
+            side = self.board.neighbors[4 * a:4 * a + 4].index(b)
+            edges.append(self.edge(a, side))
+        return edges
+
+# Heurísticas sobre um tabuleiro, calculadas em tempo constante a partir dos
+# contadores mantidos pelo próprio tabuleiro
+
+def h_por_resolver(board):
+    """Número de posições por resolver."""
+    return board.unresolved
+
+def h_ligacoes(board):
+    """Conexões das posições fixas ainda sem par, incluindo as viradas para um
+    vizinho fixo sem conexão desse lado."""
+    return board.free + board.mismatches
+
+def h_componentes(board):
+    """Componentes a mais formadas pelas posições fixas."""
+    return max(board.components - 1, 0)
+
+def h_dominio(board):
+    """Peças a mais na posição por resolver mais restringida."""
+    return board.min_domain() - 1
+
+def heuristica(board):
+    """Heurística por omissão de PipeMania: as posições por resolver, desempatadas
+    (com um peso total inferior a 1) pelas conexões sem par, pelas componentes a
+    mais e pelas peças a mais na posição mais restringida. Os tabuleiros sem
+    solução ficam com infinito. Com o custo unitário das ações nenhuma heurística
+    informativa é admissível, pois uma só atribuição pode, por propagação, fixar
+    o tabuleiro todo; h_por_resolver é exata se o custo for o número de posições
+    fixadas."""
+    if not board.valid:
+        return np.inf
+    penalty = h_ligacoes(board) + h_componentes(board) + h_dominio(board)
+    return board.unresolved + penalty / (16 * board.rows * board.cols + 16)
 
 class PipeMania(Problem):
-    def __init__(self, board: Board):
-        """O construtor especifica o estado inicial."""
+    def __init__(self, board: Board, probes=0, heuristic=heuristica):
+        """O construtor especifica o estado inicial. Com 'probes', cada estado é
+        sondado (ver Board.probe) com esse orçamento antes de se escolher a posição
+        a ramificar. 'heuristic' é a função de um tabuleiro usada por h."""
+        self.heuristic = heuristic
+        self.probes = probes
+        self.probe_cache = {}
+        if probes and board.valid:
+            board = board.copy()
+            board.valid = board.probe(probes, self.probe_cache)
         state = PipeManiaState(board)
         super().__init__(state)
         pass
@@ -178,11 +1020,11 @@ class PipeMania(Problem):
     def actions(self, state: PipeManiaState):
         """Retorna uma lista de ações que podem ser executadas a
         partir do estado passado como argumento."""
-        lista = state.board.incompatible_pieces
-        if len(lista) == 0:
+        cell = state.board.most_constrained()
+        if cell is None or not state.board.valid:
             return []
         
-        row , col = lista[0]
+        row, col = cell
 
         possibilities = state.board.action_piece(row, col)
         return map(lambda piece: (row, col, piece), possibilities)
@@ -194,9 +1036,10 @@ class PipeMania(Problem):
         self.actions(state)."""
         (row, col, piece) = action
 
-        new_board = Board(np.copy(state.board.matrix))
-        new_board.matrix[row][col] = piece
-        new_board.incompatible_pieces = state.board.incompatible_pieces[1:]
+        new_board = state.board.copy()
+        new_board.valid = new_board.assign(row, col, piece)
+        if self.probes and new_board.valid:
+            new_board.valid = new_board.probe(self.probes, self.probe_cache)
 
         return PipeManiaState(new_board)
 
@@ -205,41 +1048,863 @@ class PipeMania(Problem):
         um estado objetivo. Deve verificar se todas as posições do tabuleiro
         estão preenchidas de acordo com as regras do problema."""
         """Verifica se todas as peças do tabuleiro formam um único componente conectado."""
-        visited = np.zeros((state.board.rows, state.board.cols), dtype=bool)
-        stack = []
-        
-        stack.append((0, 0))
-        # DFS
-        while stack:
-            row, col = stack.pop()
-            if not visited[row][col]:
-                visited[row][col] = True
-                neighbors = state.board.get_neighbors(row, col)
-                for neighbor_piece, index in neighbors:
-                    if neighbor_piece is not None:
-                        nr, nc = state.board.determine_neighbor_position(row, col, index)
-                        if not visited[nr][nc]:
-                            # Verifica se as peças são compatíveis
-                            piece_connections = pecasT[state.board.get_value(row, col)]
-                            neighbor_connections = pecasT[neighbor_piece]
-                            if piece_connections[index] == neighbor_connections[(index + 2) % 4] == 1:
-                                stack.append((nr, nc))
-                            elif piece_connections[index] != neighbor_connections[(index + 2) % 4]:
-                                return False
-        
-        # Verifica se todas as peças foram visitadas
-        for r in range(state.board.rows):
-            for c in range(state.board.cols):
-                if state.board.matrix[r][c] is not None and not visited[r][c]:
-                    return False
-        return True
+        return state.board.is_solved()
     
     def h(self, node):
-        """Função heurística utilizada no problema."""
-        return len(node.state.board.incompatible_pieces)
+        """Função heurística utilizada no problema (ver heuristica)."""
+        return self.heuristic(node.state.board)
+
+# Número de posições do balde mais restringido comparadas na escolha da posição a ramificar
+AMOSTRA = 8
+
+def branch(board, conflicts=None, failures=None, rng=None):
+    """Escolhe a posição a ramificar e retorna a linha, a coluna e as suas peças,
+    ou None se todas as posições estiverem fixas. Sem 'rng', é a posição de
+    most_constrained, com as peças pela ordem dos códigos. Com 'rng', é a que mais
+    falhou ('conflicts') entre as primeiras AMOSTRA posições do balde mais
+    restringido, desfazendo empates ao acaso, e as peças vão das que menos
+    falharam ('failures') para as que mais falharam."""
+    if rng is None:
+        cell = board.most_constrained()
+        return None if cell is None else cell + (board.action_piece(*cell),)
+    bucket = next((bucket for bucket in board.buckets if bucket), None)
+    if bucket is None:
+        return None
+    index = max(itertools.islice(bucket, AMOSTRA), key=lambda i: (conflicts[i], rng.random()))
+    row, col = divmod(index, board.cols)
+    pieces = board.action_piece(row, col)
+    rng.shuffle(pieces)
+    pieces.sort(key=lambda piece: failures[16 * index + (piece & CONEXOES)])
+    return row, col, pieces
+
+def restart_budgets(unit, growth=None):
+    """Limites de retrocessos das tentativas sucessivas de uma procura com
+    recomeços: unit * luby(i) na tentativa i, ou unit * growth ** (i - 1) se
+    'growth' for dado (sequência geométrica). Se 'unit' for None, há uma única
+    tentativa, sem limite (None)."""
+    if unit is None:
+        yield None
+        return
+    for run in itertools.count(1):
+        yield unit * (luby(run) if growth is None else growth ** (run - 1))
+
+def trail_backtrack(board, conflicts=None, failures=None, rng=None, budget=None,
+                    probes=0, cache=None, visit=None):
+    """Retrocesso cronológico a partir do estado atual de 'board', com o trilho
+    ativo: cada atribuição fica registada no trilho e é desfeita ao retroceder.
+    A posição a ramificar e a ordem das peças são dadas por branch; se 'conflicts'
+    e 'failures' forem dados, cada fracasso é acumulado neles. Com 'probes', cada
+    atribuição é seguida de uma sondagem com esse orçamento (ver Board.probe).
+    'visit', se dado, é chamado com a pilha de pontos de escolha sempre que se
+    junta um novo. Retorna True se o tabuleiro ficar resolvido, False se a árvore
+    se esgotar sem solução, ou None se se esgotarem os 'budget' retrocessos."""
+    stack = [] # Pontos de escolha: [marca do trilho, linha, coluna, peças, próxima peça]
+    while True:
+        choice = branch(board, conflicts, failures, rng)
+        if choice is None:
+            if board.is_solved():
+                return True
+        else:
+            row, col, pieces = choice
+            stack.append([len(board.trail), row, col, pieces, 0])
+            if visit is not None:
+                visit(stack)
+
+        # Experimenta a próxima peça do ponto de escolha mais recente, retrocedendo se preciso
+        while stack:
+            if budget is not None and budget <= 0:
+                return None
+            entry = stack[-1]
+            mark, row, col, pieces, next_piece = entry
+            board.undo(mark)
+            while next_piece < len(pieces):
+                piece = pieces[next_piece]
+                next_piece += 1
+                if board.assign(row, col, piece) and (not probes or board.probe(probes, cache)):
+                    break
+                board.undo(mark)
+                if conflicts is not None:
+                    index = row * board.cols + col
+                    conflicts[index] += 1
+                    failures[16 * index + (piece & CONEXOES)] += 1
+                if budget is not None:
+                    budget -= 1
+            else:
+                stack.pop()
+                continue
+            entry[4] = next_piece
+            break
+        else:
+            return False
+
+def depth_first_trail_search(problem, seed=None, probes=0, unit=None, growth=None):
+    """Procura em profundidade primeiro sobre um único tabuleiro, alterado no
+    lugar (ver trail_backtrack), em vez de se copiar o tabuleiro para cada
+    sucessor. Com 'seed', a escolha da posição e a ordem das peças são aleatórias
+    (reprodutíveis) e guiadas pelos fracassos acumulados (ver branch). Com 'unit',
+    a procura é recomeçada do início sempre que esgota o limite de retrocessos da
+    tentativa (ver restart_budgets), mantendo os fracassos acumulados. Com
+    'probes', cada atribuição é seguida de uma sondagem com esse orçamento (ver
+    Board.probe)."""
+    initial = problem.initial.board
+    if not initial.valid:
+        return None
+
+    board = initial.copy()
+    board.trail = []
+    cache = {}
+    if probes and not board.probe(probes, cache):
+        return None
+    base = len(board.trail)
+    rng = None if seed is None else random.Random(seed)
+    n = board.rows * board.cols
+    conflicts = [0] * n # Fracassos de cada posição
+    failures = [0] * (16 * n) # Fracassos de cada máscara em cada posição
+
+    for budget in restart_budgets(unit, growth):
+        board.undo(base)
+        solved = trail_backtrack(board, conflicts, failures, rng, budget, probes, cache)
+        if solved:
+            return Node(PipeManiaState(board))
+        if solved is not None:
+            return None # A árvore foi esgotada sem solução
+
+def depth_first_restart_search(problem, seed=0, unit=64, growth=None):
+    """Procura em profundidade no lugar recomeçada do início sempre que esgota o
+    limite de retrocessos da tentativa: depth_first_trail_search com 'seed' e
+    'unit' (ver restart_budgets). Os fracassos de cada posição e de cada peça em
+    cada posição são acumulados ao longo das tentativas: entre as posições mais
+    restringidas ramifica-se primeiro a que mais falhou, e as peças que menos
+    falharam são experimentadas primeiro (ver branch)."""
+    return depth_first_trail_search(problem, seed, unit=unit, growth=growth)
+
+def depth_first_backjump_search(problem, seed=None, unit=64, growth=None,
+                                capacity=NOGOODS, limit=NOGOOD_MAXIMO):
+    """Procura em profundidade no lugar com retrocesso dirigido por conflitos.
+    Cada redução de domínio fica associada aos níveis de decisão que a causaram
+    (conjuntos de bits em board.culprits). Quando as peças de uma posição se
+    esgotam, a procura salta diretamente para o nível mais recente entre os
+    responsáveis pelas falhas, e as decisões desses níveis são guardadas como
+    nogood (se tiverem no máximo 'limit' pares) para podar o mesmo conflito
+    noutros ramos. Um ciclo ou uma componente isolada é culpa dos níveis
+    responsáveis pelas peças da componente; falhas sem explicação culpam todos
+    os níveis anteriores, como no retrocesso cronológico.
+    Com 'seed', a procura é recomeçada e ramifica como depth_first_restart_search,
+    e os nogoods aprendidos são mantidos entre tentativas."""
+    initial = problem.initial.board
+    if not initial.valid:
+        return None
+
+    board = initial.copy()
+    board.trail = []
+    n = board.rows * board.cols
+    board.culprits = [0] * (n + 1)
+    board.component_culprits = [0] * n
+    nogoods = Nogoods(capacity)
+    rng = None if seed is None else random.Random(seed)
+    conflicts = [0] * n # Fracassos de cada posição
+    failures = [0] * (16 * n) # Fracassos de cada máscara em cada posição
+
+    for budget in restart_budgets(None if seed is None else unit, growth):
+        board.undo(0)
+        # Pontos de escolha: [marca do trilho, linha, coluna, peças por experimentar,
+        # níveis responsáveis pelas falhas, decisão atual (índice, máscara)]
+        stack = []
+
+        while True:
+            choice = branch(board, conflicts, failures, rng)
+            if choice is None:
+                if board.is_solved():
+                    return Node(PipeManiaState(board))
+                if stack:
+                    stack[-1][4] |= (1 << (len(stack) - 1)) - 1
+            else:
+                row, col, pieces = choice
+                stack.append([len(board.trail), row, col, iter(pieces), 0, None])
+
+            # Experimenta a próxima peça do ponto de escolha mais recente, saltando para
+            # trás até ao nível culpado quando as peças se esgotam
+            while stack and (budget is None or budget > 0):
+                entry = stack[-1]
+                level = len(stack) - 1
+                mark, row, col, pieces = entry[:4]
+                index = row * board.cols + col
+                board.undo(mark)
+                for piece in pieces:
+                    mask = piece & CONEXOES
+                    nogood = nogoods.violated(board, index, mask)
+                    if nogood is not None:
+                        for other, _ in nogood:
+                            if other != index:
+                                entry[4] |= board.culprits[other]
+                        continue
+                    board.blame(index, 1 << level)
+                    if board.assign(row, col, piece):
+                        entry[5] = (index, mask)
+                        break
+                    conflict = board.conflict
+                    entry[4] |= (1 << level) - 1 if conflict is None else conflict & ~(1 << level)
+                    board.undo(mark)
+                    conflicts[index] += 1
+                    failures[16 * index + mask] += 1
+                    if budget is not None:
+                        budget -= 1
+                else:
+                    conflict = entry[4]
+                    if not conflict:
+                        return None # Nenhuma decisão anterior é culpada: não há solução
+                    levels = [l for l in range(level) if conflict >> l & 1]
+                    if len(levels) <= limit:
+                        nogoods.learn(tuple(stack[l][5] for l in levels))
+                    target = levels[-1]
+                    del stack[target + 1:]
+                    stack[target][4] |= conflict & ~(1 << target)
+                    continue
+                break
+            else:
+                if not stack:
+                    return None # A árvore foi esgotada sem solução
+                break # Limite de retrocessos esgotado: recomeça
+
+def sat_search(problem):
+    """Resolve o problema com o resolvedor CDCL de sat.py sobre a codificação CNF
+    do tabuleiro inicial (ver PipeManiaCNF). Sempre que o modelo encontrado não
+    for conexo (ou tiver ciclos), os cortes correspondentes são acrescentados e
+    o resolvedor continua, mantendo as cláusulas aprendidas."""
+    board = problem.initial.board
+    if not board.valid:
+        return None
+    cnf = PipeManiaCNF(board)
+    solver = CDCLSolver(cnf.nvars, cnf.clauses)
+    while solver.solve():
+        masks = cnf.decode(solver.model)
+        cuts = cnf.cuts(masks)
+        if not cuts:
+            matrix = [(code & ~CONEXOES) | m for code, m in zip(board.cells.tolist(), masks)]
+            goal = solved_board(np.array(matrix, dtype=np.uint8).reshape(board.rows, board.cols))
+            return Node(PipeManiaState(goal))
+        for clause in cuts:
+            solver.add_clause(clause)
+    return None
+
+class PipeManiaLocalState:
+    """Estado da procura local: uma orientação (máscara) para cada posição, com a
+    sentinela sem conexões no fim, e o número de ligações em que os dois lados
+    concordam. Um estado vizinho só guarda o estado de onde veio e a rotação que
+    os distingue; as máscaras são copiadas da primeira vez que são precisas, e as
+    componentes contadas da primeira vez que são pedidas."""
+    __slots__ = ('parent', 'index', 'mask', 'matched', '_masks', '_components')
+
+    def __init__(self, matched, masks=None, parent=None, index=None, mask=None):
+        self.matched = matched
+        self._masks = masks
+        self.parent = parent
+        self.index = index
+        self.mask = mask
+        self._components = None
+
+    def __lt__(self, other):
+        return self.matched < other.matched
+
+    @property
+    def masks(self):
+        if self._masks is None:
+            masks = bytearray(self.parent.masks)
+            masks[self.index] = self.mask
+            self._masks = masks
+            self.parent = None
+        return self._masks
+
+class PipeManiaLocal(Problem):
+    """Formulação de procura local (hill_climbing, simulated_annealing) de
+    PipeMania: um estado é uma orientação completa e uma ação roda uma posição
+    por resolver para outra peça do seu domínio. O valor de um estado é o número
+    de ligações concordantes, atualizado em tempo constante pelos quatro lados da
+    posição rodada; quando todas concordam, desconta-se as componentes a mais,
+    contadas só nesse caso, pois só aí decidem se o estado é objetivo."""
+
+    def __init__(self, board: Board, seed=0):
+        """Parte de um tabuleiro já propagado: as posições fixas ficam como estão e
+        cada posição por resolver começa numa peça aleatória (reprodutível) do seu
+        domínio."""
+        rng = random.Random(seed)
+        rows, cols = board.rows, board.cols
+        n = rows * cols
+        self.board = board
+        self.neighbors = board.neighbors
+        self.options = {index: [m for m in range(16) if board.domains.item(index) >> m & 1]
+                        for index in range(n) if board.pending[index]}
+        masks = bytearray(n + 1)
+        for index, code in enumerate(board.cells.tolist()):
+            masks[index] = code & CONEXOES
+        for index, options in self.options.items():
+            masks[index] = rng.choice(options)
+        # Ligações entre posições vizinhas mais lados virados para fora do tabuleiro
+        self.edges = rows * (cols - 1) + cols * (rows - 1) + 2 * (rows + cols)
+        super().__init__(PipeManiaLocalState(self.matching(masks), masks))
+
+    def matching(self, masks):
+        """Conta as ligações concordantes da orientação 'masks', percorrendo o tabuleiro."""
+        n = len(masks) - 1
+        neighbors = self.neighbors
+        return sum(bool(masks[index] & LADOS[i]) == bool(masks[neighbor] & OPOSTOS[i])
+                   for index in range(n) for i, neighbor in enumerate(neighbors[4 * index:4 * index + 4])
+                   if neighbor == n or i >= 2)
+
+    def facing(self, masks, index):
+        """Máscara dos lados da posição 'index' para os quais o vizinho (ou a borda)
+        tem uma conexão virada."""
+        left, up, right, down = self.neighbors[4 * index:4 * index + 4]
+        return (masks[left] >> 2 & 1) | (masks[up] >> 3 & 1) << 1 | (masks[right] & 1) << 2 \
+            | (masks[down] >> 1 & 1) << 3
+
+    def delta(self, masks, index, mask):
+        """Variação do número de ligações concordantes se a posição 'index' passar a
+        ter a máscara 'mask', olhando só para os seus quatro lados."""
+        facing = self.facing(masks, index)
+        return ligacoesT[masks[index] ^ facing] - ligacoesT[mask ^ facing]
+
+    def actions(self, state):
+        masks = state.masks
+        return [(index, m) for index, options in self.options.items()
+                for m in options if m != masks[index]]
+
+    def result(self, state, action):
+        index, mask = action
+        return PipeManiaLocalState(state.matched + self.delta(state.masks, index, mask),
+                                   parent=state, index=index, mask=mask)
+
+    def components(self, state):
+        """Número de componentes formadas pelas conexões concordantes (calculado
+        uma vez por estado)."""
+        if state._components is None:
+            masks, neighbors = state.masks, self.neighbors
+            n = len(masks) - 1
+            seen = bytearray(n)
+            components = 0
+            for start in range(n):
+                if seen[start]:
+                    continue
+                components += 1
+                seen[start] = 1
+                stack = [start]
+                while stack:
+                    index = stack.pop()
+                    for i, neighbor in enumerate(neighbors[4 * index:4 * index + 4]):
+                        if masks[index] & LADOS[i] and neighbor < n and not seen[neighbor] \
+                                and masks[neighbor] & OPOSTOS[i]:
+                            seen[neighbor] = 1
+                            stack.append(neighbor)
+            state._components = components
+        return state._components
+
+    def value(self, state):
+        if state.matched < self.edges:
+            return state.matched
+        return self.edges + 1 - self.components(state)
+
+    def goal_test(self, state):
+        return state.matched == self.edges and self.components(state) == 1
+
+    def solution_board(self, state):
+        """Retorna o tabuleiro (com as peças fixas) correspondente ao estado 'state'."""
+        cells = self.board.cells.tolist()
+        matrix = [(code & ~CONEXOES) | m for code, m in zip(cells, state.masks)]
+        return solved_board(np.array(matrix, dtype=np.uint8).reshape(self.board.rows, self.board.cols))
+
+# Parâmetros de min_conflicts: passos em que a orientação abandonada fica proibida,
+# probabilidade de uma rotação aleatória e passos sem melhorar antes de recomeçar
+TABU = 10
+RUIDO = 0.1
+RECOMECO = 20000
+# Número máximo de passos de min_conflicts_search, para que pare sempre
+PASSOS = 200000
+
+def min_conflicts(board, time_limit=0.1, steps=None, seed=0, tenure=TABU, noise=RUIDO, restart=RECOMECO):
+    """Procura local anytime por conflitos mínimos (como o WalkSAT), a partir do
+    tabuleiro já propagado. A orientação inicial é gulosa: da borda para dentro,
+    cada posição por resolver fica com a peça do domínio que concorda com mais
+    vizinhos. Em cada passo escolhe uma posição por resolver com algum lado em
+    desacordo com o vizinho e roda-a para a peça do domínio com mais ligações
+    concordantes (ver PipeManiaLocal.delta); com probabilidade 'noise' a peça é
+    aleatória. A orientação abandonada fica tabu durante 'tenure' passos, salvo
+    se levar a um estado melhor do que o melhor até aí. Ao fim de 'restart'
+    passos sem melhorar, recomeça de uma orientação aleatória. Pára quando
+    encontra a solução ou se esgotar o tempo 'time_limit' (em segundos) ou o
+    número de passos 'steps'. Retorna o melhor tabuleiro encontrado (segundo
+    PipeManiaLocal.value) e quanto lhe falta para ser solução (0 se o for); só
+    no primeiro caso o tabuleiro tem o estado interno calculado."""
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    problem = PipeManiaLocal(board, seed)
+    n = board.rows * board.cols
+    neighbors = problem.neighbors
+    facing = problem.facing
+    choices = [problem.options.get(index) for index in range(n)]
+    free = list(problem.options)
+    edges = problem.edges
+
+    def conflicts(masks):
+        # Lados em desacordo de cada posição por resolver e as que têm algum (numa
+        # lista, com a posição de cada uma, para escolher e retirar em tempo constante)
+        bad = bytearray(n + 1)
+        conflicted = []
+        position = [-1] * n
+        for index in free:
+            bad[index] = ligacoesT[masks[index] ^ facing(masks, index)]
+            if bad[index]:
+                position[index] = len(conflicted)
+                conflicted.append(index)
+        return bad, conflicted, position
+
+    masks = bytearray(problem.initial.masks)
+    for index in board.border_order():
+        options = choices[index]
+        if options is not None:
+            around = facing(masks, index)
+            masks[index] = min(options, key=lambda m: ligacoesT[m ^ around])
+    matched = problem.matching(masks)
+    bad, conflicted, position = conflicts(masks)
+    best, best_value = bytearray(masks), problem.value(PipeManiaLocalState(matched, masks))
+    tabu = [0] * (16 * n) # Passo até ao qual cada (posição, máscara) é tabu
+    improved = step = 0
+    while steps is None or step < steps:
+        if not conflicted:
+            # Todas as ligações concordam: é a solução se formarem uma só componente
+            value = problem.value(PipeManiaLocalState(matched, masks))
+            if value > best_value:
+                best, best_value = bytearray(masks), value
+            if value == edges or not free:
+                break
+        step += 1
+        if not step & 63 and time_limit is not None and time.perf_counter() - start >= time_limit:
+            break
+        if step - improved > restart:
+            for index in free:
+                masks[index] = rng.choice(choices[index])
+            matched = problem.matching(masks)
+            bad, conflicted, position = conflicts(masks)
+            improved = step
+            continue
+
+        # Uma posição em conflito, ou qualquer uma se só houver ciclos a desfazer
+        index = conflicted[rng.randrange(len(conflicted))] if conflicted else rng.choice(free)
+        current = masks[index]
+        around = facing(masks, index)
+        if rng.random() < noise:
+            mask = rng.choice(choices[index])
+        else:
+            mask, fewest = current, 5
+            for m in choices[index]:
+                if m == current:
+                    continue
+                wrong = ligacoesT[m ^ around]
+                if tabu[16 * index + m] >= step and matched + bad[index] - wrong <= best_value:
+                    continue
+                if wrong < fewest or wrong == fewest and rng.random() < 0.5:
+                    mask, fewest = m, wrong
+        if mask == current:
+            continue
+        matched += bad[index] - ligacoesT[mask ^ around]
+        masks[index] = mask
+        tabu[16 * index + current] = step + tenure
+
+        # Atualiza os lados em desacordo da posição rodada e dos vizinhos por resolver
+        for cell in (index,) + neighbors[4 * index:4 * index + 4]:
+            if cell == n or choices[cell] is None:
+                continue
+            bad[cell] = wrong = ligacoesT[masks[cell] ^ facing(masks, cell)]
+            if wrong and position[cell] < 0:
+                position[cell] = len(conflicted)
+                conflicted.append(cell)
+            elif not wrong and position[cell] >= 0:
+                last = conflicted.pop()
+                if last != cell:
+                    conflicted[position[cell]] = last
+                    position[last] = position[cell]
+                position[cell] = -1
+        if best_value < matched < edges:
+            best, best_value = bytearray(masks), matched
+            improved = step
+
+    if matched == edges:
+        # O orçamento pode ter acabado logo a seguir a todas as ligações concordarem
+        value = problem.value(PipeManiaLocalState(matched, masks))
+        if value > best_value:
+            best, best_value = bytearray(masks), value
+    matrix = np.array([(code & ~CONEXOES) | m for code, m in zip(board.cells.tolist(), best)],
+                      dtype=np.uint8).reshape(board.rows, board.cols)
+    if best_value < edges:
+        return Board(matrix), edges - best_value
+    return solved_board(matrix), 0
+
+def min_conflicts_search(problem, seed=0, steps=PASSOS, time_limit=None):
+    """Procura por conflitos mínimos (ver min_conflicts), por omissão limitada a
+    PASSOS passos e sem limite de tempo. Retorna o nó objetivo, ou None se não
+    encontrar a solução."""
+    board = problem.initial.board
+    if not board.valid:
+        return None
+    goal, conflicts = min_conflicts(board, time_limit, steps, seed)
+    return Node(PipeManiaState(goal)) if not conflicts and goal.is_solved() else None
+
+def solve(board):
+    """Resolve o tabuleiro 'board'. Retorna o tabuleiro resolvido, ou None se não houver solução."""
+    goal_node = depth_first_backjump_search(PipeMania(board), seed=0)
+    return None if goal_node is None else goal_node.state.board
+
+def solve_batch(stream=None, out=None):
+    """Resolve por ordem os tabuleiros lidos de 'stream' (ver Board.parse_instances)
+    e escreve as soluções em 'out', separadas por linhas em branco. Num só processo,
+    as tabelas de peças, de vizinhos e de Zobrist são calculadas uma vez e partilhadas
+    pelos tabuleiros com as mesmas dimensões. Um tabuleiro sem solução fica em branco.
+    Retorna o número de tabuleiros resolvidos."""
+    out = sys.stdout if out is None else out
+    solved = 0
+    for count, board in enumerate(Board.parse_instances(stream)):
+        if count:
+            out.write("\n")
+        goal = solve(board)
+        if goal is None:
+            print("Tabuleiro", count + 1, "sem solução", file=sys.stderr)
+            continue
+        goal.print_matrix(out)
+        solved += 1
+    return solved
+
+def solved_board(matrix):
+    """Retorna o tabuleiro com a matriz de códigos 'matrix', de uma solução obtida
+    noutro processo, com cada peça fixa na orientação em que está."""
+    board = Board(matrix)
+    domains = np.ones(board.rows * board.cols + 1, dtype=np.uint16)
+    domains[:-1] <<= board.cells & CONEXOES
+    board.calculate_state()
+    board.valid = board.valid and board.apply_domains(domains)
+    return board
+
+# Estratégias do portefólio: "trail" é depth_first_trail_search, "random:S" é a mesma
+# procura com a semente S, "restart:S" é depth_first_restart_search com a semente S,
+# "backjump" é depth_first_backjump_search, "backjump:S" é a mesma procura com
+# recomeços e a semente S, "sat" é sat_search, "probe" e "probe:N" são
+# depth_first_trail_search com sondagem (de orçamento N), "minconflicts:S" é
+# min_conflicts_search com a semente S, e as restantes são procuras de search.py
+PORTFOLIO = ("backjump:1", "trail", "random:1", "restart:1", "depth_first_tree_search", "greedy_search")
+SEARCHES = {search.__name__: search for search in (astar_search, breadth_first_tree_search,
+            depth_first_tree_search, greedy_search, recursive_best_first_search)}
+
+def run_strategy(problem, strategy):
+    """Resolve 'problem' com a estratégia 'strategy' do portefólio. Retorna o nó objetivo ou None."""
+    if strategy == "trail":
+        return depth_first_trail_search(problem)
+    if strategy.startswith("random:"):
+        return depth_first_trail_search(problem, int(strategy[len("random:"):]))
+    if strategy == "sat":
+        return sat_search(problem)
+    if strategy.startswith("minconflicts:"):
+        return min_conflicts_search(problem, int(strategy[len("minconflicts:"):]))
+    if strategy == "probe":
+        return depth_first_trail_search(problem, probes=SONDAGENS)
+    if strategy.startswith("probe:"):
+        return depth_first_trail_search(problem, probes=int(strategy[len("probe:"):]))
+    if strategy == "backjump":
+        return depth_first_backjump_search(problem)
+    if strategy.startswith("backjump:"):
+        return depth_first_backjump_search(problem, int(strategy[len("backjump:"):]))
+    if strategy.startswith("restart:"):
+        return depth_first_restart_search(problem, int(strategy[len("restart:"):]))
+    return SEARCHES[strategy](problem)
+
+def race_strategy(matrix, strategy, results):
+    """Resolve num processo do portefólio o tabuleiro com a matriz de códigos
+    'matrix' e coloca em 'results' a estratégia e a matriz resolvida (ou None)."""
+    solution = None
+    try:
+        goal_node = run_strategy(PipeMania(Board(matrix).calculate_state()), strategy)
+        if goal_node is not None:
+            solution = goal_node.state.board.matrix.tolist()
+    finally:
+        results.put((strategy, solution))
+
+def solve_portfolio(board, strategies=PORTFOLIO):
+    """Corre as estratégias 'strategies' (ver PORTFOLIO) em paralelo, uma por
+    processo, sobre o tabuleiro 'board'. Assim que uma encontra a solução, as
+    restantes são canceladas; um tabuleiro devolvido que não esteja resolvido é
+    ignorado. Retorna a estratégia vencedora e o tabuleiro resolvido, ou
+    (None, None) se nenhuma encontrar solução."""
+    results = multiprocessing.Queue()
+    matrix = board.matrix.tolist()
+    workers = [multiprocessing.Process(target=race_strategy, args=(matrix, strategy, results), daemon=True)
+               for strategy in strategies]
+    for worker in workers:
+        worker.start()
+    try:
+        pending = len(workers)
+        while pending:
+            try:
+                strategy, solution = results.get(timeout=0.1)
+            except queue.Empty:
+                # Um processo que morra sem responder (por exemplo, sem memória) não conta
+                if any(worker.is_alive() for worker in workers):
+                    continue
+                # Os resultados enviados pouco antes de os processos terminarem podem
+                # só agora estar disponíveis
+                try:
+                    strategy, solution = results.get_nowait()
+                except queue.Empty:
+                    break
+            pending -= 1
+            if solution is not None:
+                # Uma estratégia com erros não pode dar uma resposta errada
+                goal = solved_board(solution)
+                if goal.is_solved():
+                    return strategy, goal
+                print("Estratégia", strategy, "devolveu um tabuleiro por resolver", file=sys.stderr)
+        return None, None
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+def solve_matrix(matrix):
+    """Resolve o tabuleiro com a matriz de códigos 'matrix', num processo do
+    conjunto de solve_parallel. Retorna o texto da solução (None se não houver)
+    e o tempo gasto, em segundos."""
+    start = time.perf_counter()
+    goal = solve(Board(matrix).calculate_state())
+    text = None
+    if goal is not None:
+        text = "\n".join("\t".join(nomesT[item] for item in row) for row in goal.matrix.tolist())
+    return text, time.perf_counter() - start
+
+def solve_parallel(stream=None, out=None, processes=None, chunksize=1):
+    """Como solve_batch, mas distribui os tabuleiros por um conjunto de 'processes'
+    processos (por omissão, um por CPU). As soluções são escritas pela ordem de
+    entrada assim que ficam disponíveis, e o tempo de cada tabuleiro é indicado
+    no standard error. Retorna o número de tabuleiros resolvidos."""
+    out = sys.stdout if out is None else out
+    solved = 0
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.imap(solve_matrix, Board.read_matrices(stream), chunksize)
+        for count, (text, elapsed) in enumerate(results):
+            if count:
+                out.write("\n")
+            if text is None:
+                print("Tabuleiro", count + 1, "sem solução", file=sys.stderr)
+            else:
+                out.write(text + "\n")
+                solved += 1
+            out.flush()
+            print("Tabuleiro {}: {:.3f} s".format(count + 1, elapsed), file=sys.stderr)
+    return solved
+
+# Procura em profundidade paralela com roubo de trabalho. Um subproblema é uma
+# atribuição parcial: a lista de pares (índice, código) a atribuir, por ordem,
+# ao tabuleiro inicial.
+DOACAO = 256 # Número de pontos de escolha entre verificações de processos parados
+
+def split_tasks(board, count):
+    """Expande em largura os primeiros níveis da árvore de procura de 'board' até
+    haver pelo menos 'count' subproblemas. Retorna a lista de subproblemas e o
+    tabuleiro resolvido, se algum dos nós expandidos já for a solução."""
+    board = board.copy()
+    board.trail = []
+    frontier = deque([[]])
+    while frontier and len(frontier) < count:
+        task = frontier.popleft()
+        board.undo(0)
+        if not all(board.assign(*divmod(index, board.cols), code) for index, code in task):
+            continue
+        cell = board.most_constrained()
+        if cell is None:
+            if board.is_solved():
+                return [], board
+            continue
+        index = cell[0] * board.cols + cell[1]
+        frontier.extend(task + [(index, piece)] for piece in board.action_piece(*cell))
+    return list(frontier), None
+
+def explore_task(board, task, tasks, idle, outstanding):
+    """Procura em profundidade, no lugar, a solução do subproblema 'task' de 'board'
+    (com o trilho vazio), com trail_backtrack. Quando há processos parados e a fila
+    de subproblemas está vazia, doa as peças por experimentar do ponto de escolha
+    menos profundo. Retorna a matriz resolvida, ou None se o subproblema não
+    tiver solução."""
+    for index, code in task:
+        if not board.assign(*divmod(index, board.cols), code):
+            return None
+    steps = 0
+
+    def donate(stack):
+        nonlocal steps
+        steps += 1
+        if steps % DOACAO or not idle.value or not tasks.empty():
+            return
+        last = len(stack) - 1
+        for level, (_, row, col, pieces, next_piece) in enumerate(stack):
+            # Fica com uma peça se for o ponto de escolha atual, ainda por experimentar
+            start = next_piece + (level == last)
+            if start < len(pieces):
+                # Atribuições até este ponto de escolha: o subproblema e a peça atual
+                # de cada ponto de escolha anterior
+                path = list(task) + [(r * board.cols + c, p[k - 1]) for _, r, c, p, k in stack[:level]]
+                index = row * board.cols + col
+                donated = [path + [(index, piece)] for piece in pieces[start:]]
+                stack[level][3] = pieces[:start]
+                with outstanding.get_lock():
+                    outstanding.value += len(donated)
+                for subtask in donated:
+                    tasks.put(subtask)
+                return
+
+    return board.matrix.tolist() if trail_backtrack(board, visit=donate) else None
+
+def steal_worker(matrix, tasks, results, idle, outstanding, busy, worker):
+    """Processo de solve_work_stealing: resolve subproblemas da fila 'tasks' até
+    receber None. Coloca em 'results' cada solução encontrada, e None quando já
+    não há subproblemas por terminar. busy[worker] fica a 1 enquanto o processo
+    tem um subproblema em mãos."""
+    initial = Board(matrix).calculate_state()
+    board = initial.copy()
+    board.trail = []
+    while True:
+        with idle.get_lock():
+            idle.value += 1
+        task = tasks.get()
+        busy[worker] = 1
+        with idle.get_lock():
+            idle.value -= 1
+        if task is None:
+            return
+        board.undo(0)
+        solution = explore_task(board, task, tasks, idle, outstanding)
+        if solution is not None:
+            results.put(solution)
+        with outstanding.get_lock():
+            outstanding.value -= 1
+            if not outstanding.value:
+                results.put(None)
+        busy[worker] = 0
+
+def solve_work_stealing(board, processes=None):
+    """Resolve o tabuleiro 'board' com uma procura em profundidade repartida por
+    'processes' processos (por omissão, um por CPU). Os primeiros níveis da árvore
+    são divididos em subproblemas numa fila partilhada, e os processos ocupados
+    doam subárvores por explorar quando outros ficam parados. Retorna o tabuleiro
+    resolvido, ou None se não houver solução (ou se um processo morrer e os
+    restantes não a encontrarem)."""
+    if not board.valid:
+        return None
+    processes = processes or multiprocessing.cpu_count()
+    initial, goal = split_tasks(board, 2 * processes)
+    if goal is not None or not initial:
+        return goal
+
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    idle = multiprocessing.Value('i', 0)
+    outstanding = multiprocessing.Value('i', len(initial))
+    busy = multiprocessing.Array('b', processes) # 1 nos processos com um subproblema em mãos
+    for task in initial:
+        tasks.put(task)
+    matrix = board.matrix.tolist()
+    workers = [multiprocessing.Process(target=steal_worker,
+                                       args=(matrix, tasks, results, idle, outstanding, busy, worker),
+                                       daemon=True) for worker in range(processes)]
+    for worker in workers:
+        worker.start()
+    try:
+        stalled = 0 # Verificações seguidas sem nenhum processo vivo a trabalhar
+        while True:
+            try:
+                solution = results.get(timeout=0.1)
+                break
+            except queue.Empty:
+                pass
+            # Um processo que morra (por exemplo, sem memória) leva consigo o seu
+            # subproblema, e 'outstanding' nunca chega a zero: desiste-se quando não
+            # restar nenhum processo vivo ou quando, em duas verificações seguidas
+            # (um processo pode ter acabado de tirar um subproblema da fila sem ainda
+            # se ter marcado), nenhum processo vivo estiver a trabalhar e a fila
+            # estiver vazia
+            alive = [worker.is_alive() for worker in workers]
+            if all(alive):
+                continue
+            working = any(busy[k] for k in range(processes) if alive[k])
+            stalled = 0 if any(alive) and (working or not tasks.empty()) else stalled + 1
+            if stalled < 2:
+                continue
+            # Uma solução pode ter chegado entretanto
+            solution = None
+            try:
+                while solution is None:
+                    solution = results.get_nowait()
+            except queue.Empty:
+                print("Processo de procura terminado sem resposta", file=sys.stderr)
+            break
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+    return None if solution is None else solved_board(solution)
 
 if __name__ == "__main__":
-    board = Board.parse_instance()
-    problem = PipeMania(board)
-    goal_node = depth_first_tree_search(problem)
-    goal_node.state.board.print_matrix()
\ No newline at end of file
+    # Com --batch, lê e resolve vários tabuleiros do standard input; com --jobs N,
+    # resolve-os em N processos (0 para um por CPU). Com --portfolio [E1,E2,...],
+    # resolve um tabuleiro correndo várias estratégias em paralelo. Com --workers N,
+    # resolve um tabuleiro com a procura em profundidade repartida por N processos
+    # Com --sat, resolve um tabuleiro com o resolvedor CDCL; com --dimacs, escreve
+    # a sua codificação CNF (sem os cortes de conectividade) em formato DIMACS.
+    # Com --anytime [MS], escreve o melhor tabuleiro que a procura por conflitos
+    # mínimos encontrar em MS milissegundos (100 por omissão), resolvido ou não
+    if "--anytime" in sys.argv[1:]:
+        position = sys.argv.index("--anytime") + 1
+        milliseconds = 100
+        if position < len(sys.argv) and not sys.argv[position].startswith("--"):
+            milliseconds = int(sys.argv[position])
+        best, conflicts = min_conflicts(Board.parse_instance(), milliseconds / 1000)
+        print("Ligações em desacordo:", conflicts, file=sys.stderr)
+        best.print_matrix()
+    elif "--dimacs" in sys.argv[1:]:
+        board = Board.parse_instance()
+        cnf = PipeManiaCNF(board)
+        write_dimacs(cnf.clauses, cnf.nvars, sys.stdout,
+                     ["PipeMania {}x{}".format(board.rows, board.cols)])
+    elif "--sat" in sys.argv[1:]:
+        goal_node = sat_search(PipeMania(Board.parse_instance()))
+        if goal_node is None:
+            print("Tabuleiro sem solução", file=sys.stderr)
+        else:
+            goal_node.state.board.print_matrix()
+    elif "--workers" in sys.argv[1:]:
+        workers = int(sys.argv[sys.argv.index("--workers") + 1])
+        goal = solve_work_stealing(Board.parse_instance(), workers or None)
+        if goal is None:
+            print("Tabuleiro sem solução", file=sys.stderr)
+        else:
+            goal.print_matrix()
+    elif "--portfolio" in sys.argv[1:]:
+        position = sys.argv.index("--portfolio") + 1
+        strategies = PORTFOLIO
+        if position < len(sys.argv) and not sys.argv[position].startswith("--"):
+            strategies = tuple(sys.argv[position].split(","))
+        winner, goal = solve_portfolio(Board.parse_instance(), strategies)
+        if goal is None:
+            print("Tabuleiro sem solução", file=sys.stderr)
+        else:
+            print("Estratégia vencedora:", winner, file=sys.stderr)
+            goal.print_matrix()
+    elif "--jobs" in sys.argv[1:]:
+        jobs = int(sys.argv[sys.argv.index("--jobs") + 1])
+        solve_parallel(processes=jobs or None)
+    elif "--batch" in sys.argv[1:]:
+        solve_batch()
+    else:
+        board = Board.parse_instance()
+        problem = PipeMania(board)
+        goal_node = depth_first_backjump_search(problem, seed=0)
+        if goal_node is None:
+            print("Tabuleiro sem solução", file=sys.stderr)
+        else:
+            goal_node.state.board.print_matrix()
\ No newline at end of file
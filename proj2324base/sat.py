@@ -0,0 +1,302 @@
+"""
+Propositional satisfiability (Chapter 7) over clauses in DIMACS form.
+
+A clause is a list of nonzero ints: the literal v stands for variable v being
+true and -v for it being false. Variables are numbered from 1 to nvars.
+CDCLSolver is a conflict-driven clause learning solver with two watched
+literals, VSIDS branching, first-UIP learning, phase saving and Luby restarts.
+Clauses may be added between calls to solve, so it can be used incrementally,
+e.g. to add lazily generated constraints when a model is rejected.
+"""
+
+import heapq
+
+from utils import luby
+
+
+def write_dimacs(clauses, nvars, file, comments=()):
+    """Write the clauses to file in DIMACS CNF format."""
+    for comment in comments:
+        file.write('c {}\n'.format(comment))
+    file.write('p cnf {} {}\n'.format(nvars, len(clauses)))
+    for clause in clauses:
+        file.write(' '.join(map(str, clause)) + ' 0\n')
+
+
+def parse_dimacs(lines):
+    """Read a DIMACS CNF file (an iterable of lines) and return (clauses, nvars)."""
+    clauses, clause, nvars = [], [], 0
+    for line in lines:
+        words = line.split()
+        if not words or words[0] in ('c', '%'):
+            continue
+        if words[0] == 'p':
+            nvars = int(words[2])
+            continue
+        for literal in map(int, words):
+            if literal:
+                clause.append(literal)
+            else:
+                clauses.append(clause)
+                clause = []
+    if clause:
+        clauses.append(clause)
+    return clauses, nvars
+
+
+class CDCLSolver:
+    """A CDCL SAT solver. Add clauses with add_clause (or in the constructor),
+    then call solve; after a satisfiable answer, model[v] is the value of
+    variable v."""
+
+    def __init__(self, nvars, clauses=(), var_decay=0.95, restart_unit=100):
+        self.nvars = nvars
+        self.offset = nvars  # value and watches are indexed by offset + literal
+        self.value = [0] * (2 * nvars + 1)  # 1 true, -1 false, 0 unassigned
+        self.watches = [[] for _ in range(2 * nvars + 1)]  # clauses watching each literal
+        self.level = [0] * (nvars + 1)
+        self.reason = [None] * (nvars + 1)
+        self.activity = [0.0] * (nvars + 1)
+        self.phase = [-1] * (nvars + 1)  # saved polarity, false first
+        self.heap = [(0.0, v) for v in range(1, nvars + 1)]  # (-activity, var), lazily updated
+        self.trail = []
+        self.trail_lim = []  # trail position where each decision level starts
+        self.qhead = 0
+        self.learnts = []
+        self.max_learnts = 4000
+        self.var_inc = 1.0
+        self.var_decay = var_decay
+        self.restart_unit = restart_unit
+        self.ok = True  # False once the clauses are known to be unsatisfiable
+        self.model = None
+        self.conflicts = 0
+        for clause in clauses:
+            self.add_clause(clause)
+
+    def lit_value(self, literal):
+        return self.value[self.offset + literal]
+
+    def add_clause(self, clause):
+        """Add a clause at decision level 0. Return False if the clauses became
+        unsatisfiable."""
+        if not self.ok:
+            return False
+        self.cancel_until(0)
+        simplified = []
+        for literal in set(clause):
+            if -literal in clause:
+                return True  # tautology
+            value = self.lit_value(literal)
+            if value > 0:
+                return True  # already satisfied
+            if value == 0:
+                simplified.append(literal)
+        if not simplified:
+            self.ok = False
+        elif len(simplified) == 1:
+            self.enqueue(simplified[0], None)
+            self.ok = self.propagate() is None
+        else:
+            self.attach(simplified)
+        return self.ok
+
+    def attach(self, clause):
+        offset = self.offset
+        self.watches[offset + clause[0]].append(clause)
+        self.watches[offset + clause[1]].append(clause)
+
+    def enqueue(self, literal, reason):
+        offset, var = self.offset, abs(literal)
+        self.value[offset + literal] = 1
+        self.value[offset - literal] = -1
+        self.level[var] = len(self.trail_lim)
+        self.reason[var] = reason
+        self.trail.append(literal)
+
+    def propagate(self):
+        """Unit propagation with two watched literals. Return a conflicting
+        clause, or None."""
+        value, watches, offset, trail = self.value, self.watches, self.offset, self.trail
+        while self.qhead < len(trail):
+            false_literal = -trail[self.qhead]
+            self.qhead += 1
+            watching = watches[offset + false_literal]
+            kept = []
+            i, count = 0, len(watching)
+            while i < count:
+                clause = watching[i]
+                i += 1
+                if clause[0] == false_literal:
+                    clause[0], clause[1] = clause[1], false_literal
+                first = clause[0]
+                if value[offset + first] > 0:
+                    kept.append(clause)
+                    continue
+                for k in range(2, len(clause)):
+                    if value[offset + clause[k]] >= 0:
+                        clause[1], clause[k] = clause[k], false_literal
+                        watches[offset + clause[1]].append(clause)
+                        break
+                else:
+                    kept.append(clause)
+                    if value[offset + first] < 0:
+                        kept.extend(watching[i:])
+                        watches[offset + false_literal] = kept
+                        return clause
+                    self.enqueue(first, clause)
+            watches[offset + false_literal] = kept
+        return None
+
+    def analyze(self, conflict):
+        """First-UIP conflict analysis. Return the learnt clause (asserting
+        literal first) and the level to backjump to."""
+        level, reason, trail = self.level, self.reason, self.trail
+        current = len(self.trail_lim)
+        seen = set()
+        learnt = [None]
+        pending = 0
+        index = len(trail) - 1
+        clause = conflict
+        literal = None
+        while True:
+            for other in clause:
+                if other == literal:
+                    continue
+                var = abs(other)
+                if var not in seen and level[var] > 0:
+                    seen.add(var)
+                    self.bump(var)
+                    if level[var] == current:
+                        pending += 1
+                    else:
+                        learnt.append(other)
+            while abs(trail[index]) not in seen:
+                index -= 1
+            literal = trail[index]
+            index -= 1
+            pending -= 1
+            if not pending:
+                break
+            clause = reason[abs(literal)]
+        learnt[0] = -literal
+        # Drop literals implied by the others (local minimization)
+        kept = set(learnt)
+        learnt = [learnt[0]] + [other for other in learnt[1:]
+                                if reason[abs(other)] is None
+                                or any(x not in kept and level[abs(x)] > 0
+                                       for x in reason[abs(other)] if x != -other)]
+        if len(learnt) == 1:
+            return learnt, 0
+        # Watch the literal with the highest level second, so backjumping leaves it false last
+        best = max(range(1, len(learnt)), key=lambda k: level[abs(learnt[k])])
+        learnt[1], learnt[best] = learnt[best], learnt[1]
+        return learnt, level[abs(learnt[1])]
+
+    def bump(self, var):
+        self.activity[var] += self.var_inc
+        if self.activity[var] > 1e100:
+            self.activity = [a * 1e-100 for a in self.activity]
+            self.var_inc *= 1e-100
+            self.heap = [(-self.activity[v], v) for v in range(1, self.nvars + 1)
+                         if not self.value[self.offset + v]]
+            heapq.heapify(self.heap)
+        elif not self.value[self.offset + var]:
+            heapq.heappush(self.heap, (-self.activity[var], var))
+
+    def cancel_until(self, level):
+        """Undo all assignments above the given decision level."""
+        if len(self.trail_lim) <= level:
+            return
+        value, offset, phase, activity = self.value, self.offset, self.phase, self.activity
+        start = self.trail_lim[level]
+        for literal in self.trail[start:]:
+            var = abs(literal)
+            value[offset + var] = value[offset - var] = 0
+            phase[var] = 1 if literal > 0 else -1
+            heapq.heappush(self.heap, (-activity[var], var))
+        del self.trail[start:]
+        del self.trail_lim[level:]
+        self.qhead = len(self.trail)
+
+    def pick_branch(self):
+        """Return the unassigned variable with the highest activity, or None."""
+        heap, value, offset, activity = self.heap, self.value, self.offset, self.activity
+        while heap:
+            key, var = heapq.heappop(heap)
+            if not value[offset + var] and -key == activity[var]:
+                return var
+        for var in range(1, self.nvars + 1):  # stale heap entries only
+            if not value[offset + var]:
+                return var
+        return None
+
+    def reduce_learnts(self):
+        """Forget the longer half of the learnt clauses that are not reasons."""
+        reason = self.reason
+        locked = {id(reason[abs(c[0])]) for c in self.learnts if reason[abs(c[0])] is c}
+        self.learnts.sort(key=len)
+        half = len(self.learnts) // 2
+        dead = {id(c) for c in self.learnts[half:] if id(c) not in locked}
+        self.learnts = [c for c in self.learnts if id(c) not in dead]
+        self.watches = [[c for c in watching if id(c) not in dead] for watching in self.watches]
+        self.max_learnts = int(self.max_learnts * 1.1)
+
+    def solve(self, max_conflicts=None):
+        """Return True if the clauses are satisfiable (filling self.model),
+        False if not, or None if max_conflicts was reached first."""
+        if not self.ok:
+            return False
+        self.cancel_until(0)
+        if self.propagate() is not None:
+            self.ok = False
+            return False
+        budget_left = max_conflicts
+        run = 0
+        while True:
+            run += 1
+            budget = self.restart_unit * luby(run)
+            while True:
+                conflict = self.propagate()
+                if conflict is not None:
+                    self.conflicts += 1
+                    budget -= 1
+                    if not self.trail_lim:
+                        self.ok = False
+                        return False
+                    if budget_left is not None:
+                        budget_left -= 1
+                        if budget_left < 0:
+                            self.cancel_until(0)
+                            return None
+                    learnt, back = self.analyze(conflict)
+                    self.cancel_until(back)
+                    if len(learnt) == 1:
+                        self.enqueue(learnt[0], None)
+                    else:
+                        self.attach(learnt)
+                        self.learnts.append(learnt)
+                        self.enqueue(learnt[0], learnt)
+                    self.var_inc /= self.var_decay
+                    continue
+                if budget <= 0:
+                    self.cancel_until(0)
+                    break  # restart
+                if len(self.learnts) > self.max_learnts:
+                    self.reduce_learnts()
+                var = self.pick_branch()
+                if var is None:
+                    self.model = [False] + [self.value[self.offset + v] > 0
+                                            for v in range(1, self.nvars + 1)]
+                    self.cancel_until(0)
+                    return True
+                self.trail_lim.append(len(self.trail))
+                self.enqueue(var * self.phase[var], None)
+
+
+def cdcl_satisfiable(clauses, nvars):
+    """Return a satisfying model (a list indexed by variable) or False.
+    >>> cdcl_satisfiable([[1, 2], [-1], [-2, 3]], 3)[1:]
+    [False, True, True]
+    """
+    solver = CDCLSolver(nvars, clauses)
+    return solver.model if solver.solve() else False
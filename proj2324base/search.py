@@ -73,7 +73,13 @@ class Node:
     the total path_cost (also known as g) to reach the node. Other functions
     may add an f and h value; see best_first_graph_search and astar_search for
     an explanation of how the f and h values are handled. You will not need to
-    subclass this class."""
+    subclass this class.
+    Nodes are slotted, with room reserved for the f and h values, to keep
+    large frontiers small. A node created with keep_parent=False does not
+    reference its parent, so ancestors can be freed when only the final
+    state is needed; its path() then starts at itself."""
+
+    __slots__ = ('state', 'parent', 'action', 'path_cost', 'depth', 'f', 'h')
 
     def __init__(self, state, parent=None, action=None, path_cost=0):
         """Create a search tree Node, derived from a parent by an action."""
@@ -91,15 +97,19 @@ class Node:
     def __lt__(self, node):
         return self.state < node.state
 
-    def expand(self, problem):
+    def expand(self, problem, keep_parent=True):
         """List the nodes reachable in one step from this node."""
-        return [self.child_node(problem, action)
+        return [self.child_node(problem, action, keep_parent)
                 for action in problem.actions(self.state)]
 
-    def child_node(self, problem, action):
+    def child_node(self, problem, action, keep_parent=True):
         """[Figure 3.10]"""
         next_state = problem.result(self.state, action)
-        next_node = Node(next_state, self, action, problem.path_cost(self.path_cost, self.state, action, next_state))
+        path_cost = problem.path_cost(self.path_cost, self.state, action, next_state)
+        if keep_parent:
+            return Node(next_state, self, action, path_cost)
+        next_node = Node(next_state, None, action, path_cost)
+        next_node.depth = self.depth + 1
         return next_node
 
     def solution(self):
@@ -175,13 +185,14 @@ class SimpleProblemSolvingAgentProgram:
 # Uninformed Search algorithms
 
 
-def breadth_first_tree_search(problem):
+def breadth_first_tree_search(problem, keep_parent=True):
     """
     [Figure 3.7]
     Search the shallowest nodes in the search tree first.
     Search through the successors of a problem to find a goal.
     The argument frontier should be an empty queue.
     Repeats infinitely in case of loops.
+    With keep_parent=False only the goal node is returned, without its path.
     """
 
     frontier = deque([Node(problem.initial)])  # FIFO queue
@@ -190,17 +201,18 @@ def breadth_first_tree_search(problem):
         node = frontier.popleft()
         if problem.goal_test(node.state):
             return node
-        frontier.extend(node.expand(problem))
+        frontier.extend(node.expand(problem, keep_parent))
     return None
 
 
-def depth_first_tree_search(problem):
+def depth_first_tree_search(problem, keep_parent=True):
     """
     [Figure 3.7]
     Search the deepest nodes in the search tree first.
     Search through the successors of a problem to find a goal.
     The argument frontier should be an empty queue.
     Repeats infinitely in case of loops.
+    With keep_parent=False only the goal node is returned, without its path.
     """
 
     frontier = [Node(problem.initial)]  # Stack
@@ -209,11 +221,11 @@ def depth_first_tree_search(problem):
         node = frontier.pop()
         if problem.goal_test(node.state):
             return node
-        frontier.extend(node.expand(problem))
+        frontier.extend(node.expand(problem, keep_parent))
     return None
 
 
-def depth_first_graph_search(problem):
+def depth_first_graph_search(problem, explored=None, keep_parent=True):
     """
     [Figure 3.7]
     Search the deepest nodes in the search tree first.
@@ -221,35 +233,39 @@ def depth_first_graph_search(problem):
     The argument frontier should be an empty queue.
     Does not get trapped by loops.
     If two paths reach a state, only use the first one.
+    The explored set may be replaced by a bounded TranspositionTable.
+    With keep_parent=False only the goal node is returned, without its path.
     """
     frontier = [(Node(problem.initial))]  # Stack
 
-    explored = set()
+    explored = set() if explored is None else explored
     while frontier:
         node = frontier.pop()
         if problem.goal_test(node.state):
             return node
         explored.add(node.state)
-        frontier.extend(child for child in node.expand(problem)
+        frontier.extend(child for child in node.expand(problem, keep_parent)
                         if child.state not in explored and child not in frontier)
     return None
 
 
-def breadth_first_graph_search(problem):
+def breadth_first_graph_search(problem, explored=None, keep_parent=True):
     """[Figure 3.11]
     Note that this function can be implemented in a
     single line as below:
     return graph_search(problem, FIFOQueue())
+    The explored set may be replaced by a bounded TranspositionTable.
+    With keep_parent=False only the goal node is returned, without its path.
     """
     node = Node(problem.initial)
     if problem.goal_test(node.state):
         return node
     frontier = deque([node])
-    explored = set()
+    explored = set() if explored is None else explored
     while frontier:
         node = frontier.popleft()
         explored.add(node.state)
-        for child in node.expand(problem):
+        for child in node.expand(problem, keep_parent):
             if child.state not in explored and child not in frontier:
                 if problem.goal_test(child.state):
                     return child
@@ -257,19 +273,22 @@ def breadth_first_graph_search(problem):
     return None
 
 
-def best_first_graph_search(problem, f, display=False):
+def best_first_graph_search(problem, f, display=False, explored=None, keep_parent=True):
     """Search the nodes with the lowest f scores first.
     You specify the function f(node) that you want to minimize; for example,
     if f is a heuristic estimate to the goal, then we have greedy best
     first search; if f is node.depth then we have breadth-first search.
     There is a subtlety: the line "f = memoize(f, 'f')" means that the f
     values will be cached on the nodes as they are computed. So after doing
-    a best first search you can examine the f values of the path returned."""
+    a best first search you can examine the f values of the path returned.
+    The explored set may be replaced by a bounded TranspositionTable.
+    Nodes are kept in an indexed PriorityQueue, so states must be hashable.
+    With keep_parent=False only the goal node is returned, without its path."""
     f = memoize(f, 'f')
     node = Node(problem.initial)
     frontier = PriorityQueue('min', f)
     frontier.append(node)
-    explored = set()
+    explored = set() if explored is None else explored
     while frontier:
         node = frontier.pop()
         if problem.goal_test(node.state):
@@ -277,13 +296,12 @@ def best_first_graph_search(problem, f, display=False):
                 print(len(explored), "paths have been expanded and", len(frontier), "paths remain in the frontier")
             return node
         explored.add(node.state)
-        for child in node.expand(problem):
+        for child in node.expand(problem, keep_parent):
             if child.state not in explored and child not in frontier:
                 frontier.append(child)
             elif child in frontier:
                 if f(child) < frontier[child]:
-                    del frontier[child]
-                    frontier.append(child)
+                    frontier.replace(child)
     return None
 
 
@@ -410,17 +428,17 @@ greedy_best_first_graph_search = best_first_graph_search
 
 
 # Greedy best-first search is accomplished by specifying f(n) = h(n).
-def greedy_search(problem, h=None):
+def greedy_search(problem, h=None, explored=None, keep_parent=True):
     """f(n) = h(n)"""
     h = memoize(h or problem.h, 'h')
-    return best_first_graph_search(problem, h)
+    return best_first_graph_search(problem, h, explored=explored, keep_parent=keep_parent)
 
-def astar_search(problem, h=None, display=False):
+def astar_search(problem, h=None, display=False, explored=None, keep_parent=True):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
     else in your Problem subclass."""
     h = memoize(h or problem.h, 'h')
-    return best_first_graph_search(problem, lambda n: n.path_cost + h(n), display)
+    return best_first_graph_search(problem, lambda n: n.path_cost + h(n), display, explored, keep_parent)
 
 
 # ______________________________________________________________________________
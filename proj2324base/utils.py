@@ -478,6 +478,16 @@ def failure_test(algorithm, tests):
     return mean(int(algorithm(x) != y) for x, y in tests)
 
 
+def luby(i):
+    """Return the i-th term (counting from 1) of the Luby sequence
+    1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ..., used to schedule restarts."""
+    while True:
+        k = i.bit_length()
+        if i == (1 << k) - 1:
+            return 1 << (k - 1)
+        i -= (1 << (k - 1)) - 1
+
+
 # ______________________________________________________________________________
 # Expressions
 
@@ -724,10 +734,16 @@ class PriorityQueue:
     order) is returned first.
     If order is 'min', the item with minimum f(x) is
     returned first; if order is 'max', then it is the item with maximum f(x).
-    Also supports dict-like lookup."""
+    Also supports dict-like lookup.
+    Items must be hashable: each item indexes its live heap entries (equal items
+    may be queued more than once), so membership, lookup and deletion take O(1).
+    Deleted heap entries are only discarded lazily when they reach the top of
+    the heap. replace(item) re-prioritizes an item in O(log n)."""
 
     def __init__(self, order='min', f=lambda x: x):
         self.heap = []
+        self.entries = {}  # item -> list of its live (value, item) entries in the heap
+        self.size = 0  # number of live entries
         if order == 'min':
             self.f = f
         elif order == 'max':  # now item with max f(x)
@@ -737,44 +753,107 @@ class PriorityQueue:
 
     def append(self, item):
         """Insert item at its correct position."""
-        heapq.heappush(self.heap, (self.f(item), item))
+        entry = (self.f(item), item)
+        self.entries.setdefault(item, []).append(entry)
+        self.size += 1
+        heapq.heappush(self.heap, entry)
 
     def extend(self, items):
         """Insert each item in items at its correct position."""
         for item in items:
             self.append(item)
 
+    def replace(self, item):
+        """Remove every occurrence of item and insert item at its correct
+        position (with its current f value)."""
+        self.size -= len(self.entries.pop(item, ()))
+        self.append(item)
+
     def pop(self):
         """Pop and return the item (with min or max f(x) value)
         depending on the order."""
-        if self.heap:
-            return heapq.heappop(self.heap)[1]
-        else:
-            raise Exception('Trying to pop from empty PriorityQueue.')
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            live = self.entries.get(entry[1])
+            if live is None:
+                continue
+            for k, other in enumerate(live):
+                if other is entry:
+                    del live[k]
+                    if not live:
+                        del self.entries[entry[1]]
+                    self.size -= 1
+                    return entry[1]
+        raise Exception('Trying to pop from empty PriorityQueue.')
 
     def __len__(self):
         """Return current capacity of PriorityQueue."""
-        return len(self.heap)
+        return self.size
 
     def __contains__(self, key):
         """Return True if the key is in PriorityQueue."""
-        return any([item == key for _, item in self.heap])
+        return key in self.entries
 
     def __getitem__(self, key):
         """Returns the first value associated with key in PriorityQueue.
         Raises KeyError if key is not present."""
-        for value, item in self.heap:
-            if item == key:
-                return value
-        raise KeyError(str(key) + " is not in the priority queue")
+        try:
+            return self.entries[key][0][0]
+        except KeyError:
+            raise KeyError(str(key) + " is not in the priority queue")
 
     def __delitem__(self, key):
         """Delete the first occurrence of key."""
         try:
-            del self.heap[[item == key for _, item in self.heap].index(True)]
-        except ValueError:
+            live = self.entries[key]
+        except KeyError:
             raise KeyError(str(key) + " is not in the priority queue")
-        heapq.heapify(self.heap)
+        del live[0]
+        if not live:
+            del self.entries[key]
+        self.size -= 1
+        if len(self.heap) > 2 * self.size + 32:
+            # Too many stale entries: rebuild the heap from the live ones
+            self.heap = [entry for live in self.entries.values() for entry in live]
+            heapq.heapify(self.heap)
+
+
+class TranspositionTable:
+    """A bounded dict-like cache of states that forgets the least recently used
+    entry once more than maxsize entries are stored. Supports add and 'in', so
+    it can be passed as the explored set of the graph searches when memory must
+    stay bounded; states should have a cheap __hash__ (e.g. Zobrist hashing)."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.table = collections.OrderedDict()
+
+    def add(self, key, value=True):
+        """Store key (with an optional value), evicting the oldest entry if full."""
+        self.table[key] = value
+        self.table.move_to_end(key)
+        if len(self.table) > self.maxsize:
+            self.table.popitem(last=False)
+
+    __setitem__ = add
+
+    def __contains__(self, key):
+        """Return True if key is stored, marking it as recently used."""
+        if key in self.table:
+            self.table.move_to_end(key)
+            return True
+        return False
+
+    def __getitem__(self, key):
+        value = self.table[key]
+        self.table.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self.table else default
+
+    def __len__(self):
+        return len(self.table)
 
 
 # ______________________________________________________________________________